@@ -1,28 +1,58 @@
 import os
 import re
-import json
+import csv
+import hmac
+import hashlib
+import shutil
+import secrets
 import logging
 import requests
-from io import BytesIO
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from io import BytesIO, TextIOWrapper
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
 from datetime import datetime, timedelta
-from functools import wraps
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache, wraps
 
+import click
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    session, send_file, flash, jsonify, current_app,  make_response
+    session, send_file, flash, jsonify, current_app,  make_response, g, Response
 )
+from flask.json.provider import DefaultJSONProvider
+from flask_caching import Cache
+from flask_session import Session
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from jinja2 import FileSystemBytecodeCache
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import check_password_hash
 from werkzeug.utils import secure_filename
 
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
-
+from reportlab.lib.utils import ImageReader
+from pypdf import PdfReader, PdfWriter
+from pypdf.errors import PyPdfError
+
+from redis import Redis
+from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
 from dotenv import load_dotenv
-from PIL import Image
-from sqlalchemy import func
+from PIL import Image, UnidentifiedImageError
+import orjson
+from sqlalchemy import DDL, event, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased, contains_eager, joinedload, raiseload
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.sql import expression
 
 
@@ -35,25 +65,56 @@ logging.basicConfig(level=logging.INFO)
 load_dotenv()
 
 class Config:
-    # FIX: Use 'postgresql+psycopg2' dialect for Render compatibility
+    # FIX: Use the 'postgresql+psycopg' (psycopg 3, see requirements.txt) dialect for
+    # Render's postgres:// / postgresql:// URLs; SQLAlchemy would otherwise pick psycopg2.
+    # psycopg 3 also binds parameters server-side and auto-prepares repeated queries.
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "sqlite:///schools.db")
-    if SQLALCHEMY_DATABASE_URI.startswith("postgres://"):
-        SQLALCHEMY_DATABASE_URI = SQLALCHEMY_DATABASE_URI.replace(
-            "postgres://", "postgresql+psycopg2://", 1
-        )
+    for _scheme in ("postgres://", "postgresql://"):
+        if SQLALCHEMY_DATABASE_URI.startswith(_scheme):
+            SQLALCHEMY_DATABASE_URI = SQLALCHEMY_DATABASE_URI.replace(
+                _scheme, "postgresql+psycopg://", 1
+            )
     SECRET_KEY = os.environ.get("SECRET_KEY")
     if not SECRET_KEY:
         # Recommended practice for local dev if .env is missing
         raise ValueError("SECRET_KEY must be set in environment for security.")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pooling: Render Postgres drops idle connections, so pre-ping and
+    # recycle them. Keep pool_size + max_overflow (per gunicorn worker) below max_connections.
+    if SQLALCHEMY_DATABASE_URI.startswith("sqlite"):
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            "poolclass": StaticPool,
+            "connect_args": {"check_same_thread": False},
+        }
+    else:
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),
+            "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+            "pool_pre_ping": True,
+            "pool_recycle": 1800,
+            "pool_use_lifo": True,
+            # Room for every distinct statement the app compiles, so none are
+            # evicted from SQLAlchemy's compiled-SQL cache (default 500).
+            "query_cache_size": int(os.environ.get("DB_QUERY_CACHE_SIZE", 1200)),
+            # psycopg 3 server-side prepares a statement after this many executions
+            # on a connection, skipping the parse/plan step on repeats.
+            "connect_args": {"prepare_threshold": int(os.environ.get("DB_PREPARE_THRESHOLD", 5))},
+        }
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = "Lax"
     # Setting secure cookie flag based on environment
     SESSION_COOKIE_SECURE = os.environ.get("FLASK_ENV") == "production"
+    # Templates never change under a running production worker, so skip the
+    # per-render stat() of every template file (None keeps Flask's debug default).
+    TEMPLATES_AUTO_RELOAD = False if os.environ.get("FLASK_ENV") == "production" else None
     
     # FIX: Defined UPLOAD_FOLDER and ALLOWED_EXTENSIONS globally
     UPLOAD_FOLDER = os.path.join("static", "logos")
-    ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg"}
+    ALLOWED_EXTENSIONS = frozenset({"png", "jpg", "jpeg"})
+    # Werkzeug rejects larger request bodies (413) before reading them; logo
+    # uploads are the only large bodies this app accepts.
+    MAX_CONTENT_LENGTH = 2 * 1024 * 1024 # 2 MB
     
 
     PAYSTACK_PUBLIC_KEY = os.environ.get("PAYSTACK_PUBLIC_KEY")
@@ -63,9 +124,43 @@ class Config:
     
     TRIAL_LIMIT = 2 # Student count limit enforced after trial expires
 
+    # Response/data cache: Redis shares entries across gunicorn workers in production,
+    # SimpleCache (per-process) is used for local dev.
+    CACHE_REDIS_URL = os.environ.get("REDIS_URL")
+    CACHE_TYPE = "RedisCache" if CACHE_REDIS_URL else "SimpleCache"
+    CACHE_DEFAULT_TIMEOUT = 300
+
+    # Server-side sessions (only enabled with Redis, see below). Browser-session
+    # cookies, like Flask's default cookie session.
+    SESSION_PERMANENT = False
+    SESSION_KEY_PREFIX = "session:"
+
+    # Login rate limits are shared across gunicorn workers through Redis when available
+    RATELIMIT_STORAGE_URI = CACHE_REDIS_URL or "memory://"
+
+    # Rendered receipt PDFs are kept on disk, keyed by their content hash (see receipt_etag).
+    # Defaults to <instance_path>/receipts; prune with `flask prune-receipt-cache`.
+    RECEIPT_CACHE_DIR = os.environ.get("RECEIPT_CACHE_DIR")
+    RECEIPT_CACHE_MAX_BYTES = int(os.environ.get("RECEIPT_CACHE_MAX_MB", 512)) * 1024 * 1024
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson (much faster than stdlib json for jsonify()).
+    Types orjson can't serialize natively fall back to Flask's default handler.
+    """
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = ORJSONProvider(app)
+# Behind Render's proxy: take the client IP from X-Forwarded-For (used by the rate limiter)
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
 
 # In app.py, add this function after db/migrate initialization, before routes
 def get_logo_path(school):
@@ -77,11 +172,74 @@ def get_logo_path(school):
         return url_for('static', filename=f'logos/{school.logo_filename}')
     return None
 
-# Ensure the upload directory exists
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+# Dev-only N+1 detector: with FLASK_DEBUG=1 and `pip install nplusone`, any
+# lazy load inside a loop raises instead of silently issuing one query per row.
+if app.debug:
+    try:
+        from nplusone.ext.flask_sqlalchemy import NPlusOne
+    except ImportError:
+        logging.info("nplusone not installed; N+1 query detection disabled.")
+    else:
+        app.config["NPLUSONE_RAISE"] = True
+        NPlusOne(app)
+
+# Ensure the upload and receipt cache directories exist. The logo directory is
+# resolved once against the app root, so it doesn't depend on the working directory.
+LOGO_DIR = os.path.join(app.root_path, app.config["UPLOAD_FOLDER"])
+os.makedirs(LOGO_DIR, exist_ok=True)
+app.config["RECEIPT_CACHE_DIR"] = app.config["RECEIPT_CACHE_DIR"] or os.path.join(app.instance_path, "receipts")
+os.makedirs(app.config["RECEIPT_CACHE_DIR"], exist_ok=True)
+
+# Compiled templates are cached on disk (keyed by source checksum, so edits still
+# apply), letting freshly started gunicorn workers skip parsing/compiling them.
+jinja_cache_dir = os.path.join(app.instance_path, "jinja_cache")
+os.makedirs(jinja_cache_dir, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(jinja_cache_dir)
 
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
+cache = Cache(app)
+
+# Background jobs (PDF receipts, Paystack verification) run on an RQ worker:
+#   rq worker --url $REDIS_URL
+# Without REDIS_URL the work runs synchronously in the request.
+# With Redis, sessions are also stored server-side (Flask-Session): the cookie only
+# carries a session id, and logout really ends the session. Without it, Flask's
+# signed-cookie session is used.
+redis_client = None
+task_queue = None
+if app.config["CACHE_REDIS_URL"]:
+    redis_client = Redis.from_url(app.config["CACHE_REDIS_URL"])
+    task_queue = Queue(connection=redis_client)
+    app.config["SESSION_TYPE"] = "redis"
+    app.config["SESSION_REDIS"] = redis_client
+    Session(app)
+
+# Failed logins cost a full Argon2 verify each, so login attempts are rate limited
+# per client IP to keep password guessing from pinning workers. (Not per email:
+# that would let anyone lock a school out by posting its email with bad passwords.)
+limiter = Limiter(get_remote_address, app=app)
+
+# Argon2id password hashing (~50ms per verify, vs ~250ms for werkzeug's default PBKDF2).
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+# Verified against when the login email is unknown, so that case costs the same
+# hash as a wrong password and response times don't reveal registered emails.
+DUMMY_PASSWORD_HASH = password_hasher.hash(secrets.token_hex(16))
+
+# Shared HTTP session for Paystack: keeps the TLS connection alive across requests.
+# Retries only cover idempotent methods (GET verify), never the POST initialize.
+# Every call passes PAYSTACK_TIMEOUT (connect, read) so a hung API can't pin a worker.
+PAYSTACK_TIMEOUT = (3, 10)
+paystack_session = requests.Session()
+paystack_session.headers["Authorization"] = f"Bearer {app.config['PAYSTACK_SECRET_KEY']}"
+paystack_session.mount(
+    "https://api.paystack.co",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+    ),
+)
 
 # ---------------------------
 # MODELS
@@ -100,14 +258,17 @@ class School(db.Model):
     expected_fees_this_term = db.Column(db.Integer, default=0)
 
     # Relationship with Student
-    students = db.relationship("Student", backref="school", lazy=True)
+    # NOTE: Hot relationships use lazy="raise_on_sql" so an accidental lazy load
+    # (N+1) fails loudly. Views that need them must add an explicit loader option
+    # (joinedload/selectinload).
+    students = db.relationship("Student", back_populates="school", lazy="raise_on_sql")
 
     # ✅ Relationship with FeeStructure
     fee_structures = db.relationship(
         "FeeStructure",
         back_populates="school",           # Matches FeeStructure.school
         cascade="all, delete-orphan",
-        lazy=True
+        lazy="raise_on_sql"
     )
 
     def __repr__(self):
@@ -123,22 +284,114 @@ class Student(db.Model):
     # === NEW COLUMN FOR SOFT DELETION ===
     is_deleted = db.Column(db.Boolean, server_default=expression.false(), nullable=False)
     # ====================================
+
+    # All-time SUM(payment.amount_paid) in Kobo, maintained by the payment triggers
+    # below. Read-only from the app: never assign it from Python.
+    total_paid_kobo = db.Column(db.BigInteger, server_default="0", nullable=False)
     
-    payments = db.relationship("Payment", backref="student", lazy=True)
+    # Nothing navigates student.school (views use current_school()); raise instead of
+    # silently lazy-loading it per row if that changes
+    school = db.relationship("School", back_populates="students", lazy="raise_on_sql")
+    payments = db.relationship("Payment", back_populates="student", lazy="raise_on_sql")
+
+    # ✅ Indexes for the hot per-school lookups (reg_number duplicate check, name search/order)
+    # The trigram GIN indexes let ILIKE '%q%' (student search) use an index on Postgres;
+    # they are skipped on SQLite, where the search falls back to a scan.
+    __table_args__ = (
+        db.UniqueConstraint("school_id", "reg_number", name="_school_reg_uc"),
+        db.Index("ix_student_school_name", "school_id", "name"),
+        db.Index(
+            "ix_student_name_trgm", "name",
+            postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+        db.Index(
+            "ix_student_reg_trgm", "reg_number",
+            postgresql_using="gin", postgresql_ops={"reg_number": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+    )
 
     # Optional: __repr__ method for better debugging
     def __repr__(self):
         return f"Student('{self.name}', '{self.reg_number}')"
 
+# pg_trgm provides gin_trgm_ops for the trigram indexes above
+event.listen(
+    Student.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
+
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    amount_paid = db.Column(db.Float, nullable=False) # Stored in Naira (Float)
+    amount_paid = db.Column(db.Integer, nullable=False) # Stored in Kobo (₦1.00 = 100)
     payment_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     payment_type = db.Column(db.String(100))
     term = db.Column(db.String(20))
     session = db.Column(db.String(20))
     student_id = db.Column(db.Integer, db.ForeignKey("student.id"), nullable=False)
 
+    # Load explicitly with joinedload/selectinload(Payment.student) where rendered
+    student = db.relationship("Student", back_populates="payments", lazy="raise_on_sql")
+
+    # ✅ Indexes for per-student history (newest first) and term/session totals.
+    # ix_payment_student_amount covers SUM(amount_paid) per student (optionally per
+    # term/session), so those totals are index-only scans that never touch the table.
+    __table_args__ = (
+        db.Index("ix_payment_student_date", student_id, payment_date.desc()),
+        db.Index("ix_payment_term_session", "term", "session"),
+        db.Index("ix_payment_student_amount", "student_id", "term", "session", "amount_paid"),
+        # Dashboard "recent payments": walk newest-first and stop after the school's first 5
+        db.Index("ix_payment_date", payment_date.desc()),
+    )
+
+# Keep student.total_paid_kobo in step with every INSERT/UPDATE/DELETE on payment
+# (including raw SQL and bulk inserts), so all-time totals are one column read.
+event.listen(
+    Payment.__table__,
+    "after_create",
+    DDL("""
+        CREATE OR REPLACE FUNCTION payment_update_student_total() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE student SET total_paid_kobo = total_paid_kobo - OLD.amount_paid WHERE id = OLD.student_id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE student SET total_paid_kobo = total_paid_kobo + NEW.amount_paid WHERE id = NEW.student_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """).execute_if(dialect="postgresql")
+)
+event.listen(
+    Payment.__table__,
+    "after_create",
+    DDL("""
+        CREATE TRIGGER payment_student_total_trg
+        AFTER INSERT OR UPDATE OF amount_paid, student_id OR DELETE ON payment
+        FOR EACH ROW EXECUTE FUNCTION payment_update_student_total()
+    """).execute_if(dialect="postgresql")
+)
+for _sqlite_trigger in (
+    """
+    CREATE TRIGGER payment_student_total_ins AFTER INSERT ON payment BEGIN
+        UPDATE student SET total_paid_kobo = total_paid_kobo + NEW.amount_paid WHERE id = NEW.student_id;
+    END
+    """,
+    """
+    CREATE TRIGGER payment_student_total_upd AFTER UPDATE OF amount_paid, student_id ON payment BEGIN
+        UPDATE student SET total_paid_kobo = total_paid_kobo - OLD.amount_paid WHERE id = OLD.student_id;
+        UPDATE student SET total_paid_kobo = total_paid_kobo + NEW.amount_paid WHERE id = NEW.student_id;
+    END
+    """,
+    """
+    CREATE TRIGGER payment_student_total_del AFTER DELETE ON payment BEGIN
+        UPDATE student SET total_paid_kobo = total_paid_kobo - OLD.amount_paid WHERE id = OLD.student_id;
+    END
+    """,
+):
+    event.listen(Payment.__table__, "after_create", DDL(_sqlite_trigger).execute_if(dialect="sqlite"))
+
 # NEW MODEL: FeeStructure (UPDATED TO INCLUDE TERM AND SESSION)
 class FeeStructure(db.Model):
     __tablename__ = "fee_structure"
@@ -150,15 +403,18 @@ class FeeStructure(db.Model):
     expected_amount = db.Column(db.Integer, nullable=False, default=0)  # Stored in Kobo (₦1.00 = 100)
     school_id = db.Column(db.Integer, db.ForeignKey("school.id"), nullable=False)
 
-    # ✅ Relationship back to School
-    school = db.relationship("School", back_populates="fee_structures", lazy=True)
+    # ✅ Relationship back to School (load explicitly if ever needed, like the others)
+    school = db.relationship("School", back_populates="fee_structures", lazy="raise_on_sql")
 
-    # ✅ Prevent duplicate entries for same class, term, and session within one school
+    # ✅ Prevent duplicate entries for same class, term, and session within one school.
+    # The unique index also serves exact (school_id, class_name) lookups; the lower()
+    # expression index serves the case-insensitive class matching used for balances/receipts.
     __table_args__ = (
         db.UniqueConstraint(
             "school_id", "class_name", "term", "session",
             name="_school_class_term_session_uc"
         ),
+        db.Index("ix_fee_structure_school_class_lower", "school_id", db.func.lower(class_name)),
     )
 
     def __repr__(self):
@@ -166,9 +422,6 @@ class FeeStructure(db.Model):
         session_display = self.session or "N/A"
         return f"<FeeStructure {self.class_name} | Term: {term_display} | Session: {session_display}>"
 
-    # Relationship back to the School model (optional but recommended)
-    school = db.relationship("School", back_populates="fee_structures", lazy=True)
-
     # Helper method to format amount neatly for templates
     def formatted_amount(self):
         return f"₦{self.expected_amount / 100:,.2f}"
@@ -182,12 +435,41 @@ class FeeStructure(db.Model):
 
 
 def current_school():
-    """Retrieves the current school object from the database using the session ID."""
-    if "school_id" in session:
+    """
+    Retrieves the current school object from the database using the session ID.
+    The result is cached on `g`, so the decorators and the view share one lookup per request.
+    """
+    if "school_id" not in session:
+        return None
+    if "school" not in g:
         # Use .get() which returns None if ID not found, avoiding an exception
-        # Assuming 'db' and 'School' are defined and imported globally
-        return db.session.get(School, session["school_id"]) 
-    return None
+        g.school = db.session.get(School, session["school_id"])
+    return g.school
+
+def today():
+    """
+    Today's date (UTC, like the payment timestamps), computed once per request and
+    cached on `g` like current_school(). Subscription expiry dates compare against it.
+    """
+    if "today" not in g:
+        g.today = datetime.utcnow().date()
+    return g.today
+
+def naira_to_kobo(value):
+    """
+    Converts a Naira amount (form string or number) to integer Kobo using Decimal
+    arithmetic, so e.g. '0.29' is exactly 29 kobo with no float rounding.
+
+    Raises:
+        ValueError: if the value is not a finite number.
+    """
+    try:
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, TypeError):
+        raise ValueError(f"Invalid number format: {value}")
+    if not amount.is_finite():
+        raise ValueError(f"Invalid number format: {value}")
+    return int(amount.scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
 
 def current_user():
     """
@@ -207,6 +489,13 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Payment/auth/receipt endpoints stay reachable after the subscription expires
+TRIAL_EXEMPT_ENDPOINTS = frozenset({
+    'pay_with_paystack_subscription', 'paystack_callback', 'logout',
+    'index', 'register', 'receipt_generator_index', 'generate_receipt', 'download_receipt',
+    'receipt_status'
+})
+
 def trial_required(f):
     """
     DECORATOR: Checks if the user's subscription (time-based) has expired.
@@ -214,19 +503,14 @@ def trial_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         school = current_school()
-        now = datetime.today().date() # Compare Date fields
+        now = today() # Compare Date fields (cached per request)
 
         subscription_endpoint = 'pay_with_paystack_subscription'
         
         # Check if the subscription_expiry date is in the past
         if school and (school.subscription_expiry is None or school.subscription_expiry < now):
             # Exempt payment/auth/receipt endpoints from restriction
-            unprotected_endpoints = [
-                subscription_endpoint, 'paystack_callback', 'logout', 
-                'index', 'register', 'receipt_generator_index', 'generate_receipt', 'download_receipt'
-            ]
-            
-            if request.endpoint not in unprotected_endpoints:
+            if request.endpoint not in TRIAL_EXEMPT_ENDPOINTS:
                 flash("Your subscription has expired. Please renew to continue using all features.", "danger")
                 return redirect(url_for(subscription_endpoint))
         
@@ -234,14 +518,116 @@ def trial_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def browser_revalidated(f):
+    """
+    DECORATOR: Lets the browser keep a (per-school, so private) response but
+    revalidate it on every use with If-None-Match, getting an empty 304 when the
+    body's ETag is unchanged. Never served stale: a write that changes the body
+    changes the ETag. Applied outside @cache.cached, so cached responses get the
+    same treatment.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        response = make_response(f(*args, **kwargs))
+        if response.status_code == 200:
+            response.add_etag()
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response = response.make_conditional(request)
+        return response
+    return decorated_function
+
+def trial_limit_reached(school):
+    """
+    Returns True if the school has at least TRIAL_LIMIT students (including soft-deleted).
+    Reads at most TRIAL_LIMIT index entries instead of COUNT(*)-ing every student;
+    the result is cached on `g` for the rest of the request.
+    """
+    if "trial_limit_reached" not in g:
+        g.trial_limit_reached = (
+            db.session.query(Student.id)
+            .filter_by(school_id=school.id)
+            .offset(current_app.config["TRIAL_LIMIT"] - 1)
+            .limit(1)
+            .scalar()
+            is not None
+        )
+    return g.trial_limit_reached
+
+def school_cache_key(prefix):
+    """Returns a key_prefix callable for @cache.cached, scoped to the logged-in school."""
+    return lambda: f"{prefix}:{session.get('school_id')}"
+
+def search_cache_key():
+    """
+    key_prefix for the student search cache. Includes the school's search version,
+    which invalidate_school_cache(..., "search") replaces on every student write,
+    so all cached queries of that school go stale at once.
+    """
+    school_id = session.get("school_id")
+    version = cache.get(f"search_version:{school_id}") or 0
+    return f"search:{school_id}:{version}:{request.args.get('q', '').strip().lower()}"
+
+def skip_response_cache():
+    """Bypass the response cache for non-GET requests or when flash messages are pending."""
+    return request.method != "GET" or "_flashes" in session
+
+def invalidate_school_cache(school_id, *prefixes):
+    """
+    Drops the cached per-school entries (e.g. 'dash', 'fees') after a write.
+    'search' entries are keyed per query, so a new search version is set instead.
+    """
+    if "search" in prefixes:
+        cache.set(f"search_version:{school_id}", secrets.token_hex(4), timeout=0)
+        prefixes = tuple(prefix for prefix in prefixes if prefix != "search")
+    if prefixes:
+        cache.delete_many(*(f"{prefix}:{school_id}" for prefix in prefixes))
+
+def hash_password(password):
+    """Hashes a password with Argon2id."""
+    return password_hasher.hash(password)
+
+def verify_password(stored_hash, password):
+    """
+    Verifies a password against an Argon2id hash, or a legacy werkzeug
+    (pbkdf2/scrypt) hash created before the switch to Argon2.
+    """
+    if not stored_hash:
+        return False
+    if not stored_hash.startswith("$argon2"):
+        return check_password_hash(stored_hash, password)
+    try:
+        return password_hasher.verify(stored_hash, password)
+    except (VerifyMismatchError, InvalidHashError):
+        return False
+
+def password_needs_rehash(stored_hash):
+    """True for legacy werkzeug hashes and Argon2 hashes with outdated parameters."""
+    return not stored_hash.startswith("$argon2") or password_hasher.check_needs_rehash(stored_hash)
+
+def fetch_job(job_id):
+    """Returns the RQ job with this id, or None if it expired or never existed."""
+    try:
+        return Job.fetch(job_id, connection=task_queue.connection)
+    except NoSuchJobError:
+        return None
+
+# Bound once at import, so allowed_file() skips the app.config lookup
+ALLOWED_EXTENSIONS = app.config["ALLOWED_EXTENSIONS"]
+# Pillow format names accepted for logos (limits Image.open to these header parsers)
+ALLOWED_IMAGE_FORMATS = ("JPEG", "PNG")
+# Logos are stored downscaled to fit this box (the PDF draws them at 80x80pt)
+LOGO_MAX_SIZE = (256, 256)
+
 def allowed_file(filename):
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in app.config["ALLOWED_EXTENSIONS"]
+    _, dot, ext = filename.rpartition(".")
+    return bool(dot) and ext.lower() in ALLOWED_EXTENSIONS
 
 def get_logo_path(school):
     """Returns the URL for the school's logo, or None for template use."""
     if school and school.logo_filename:
         # Construct the local path to verify existence before creating a URL
-        file_path = os.path.join(app.config["UPLOAD_FOLDER"], school.logo_filename)
+        file_path = os.path.join(LOGO_DIR, school.logo_filename)
         if os.path.exists(file_path):
             # Return relative URL for browser/template use
             return url_for('static', filename=f'logos/{school.logo_filename}')
@@ -254,7 +640,7 @@ def get_logo_local_path(school):
     """
     if school and school.logo_filename:
         # Construct the ABSOLUTE path
-        local_path = os.path.join(app.root_path, app.config["UPLOAD_FOLDER"], school.logo_filename)
+        local_path = os.path.join(LOGO_DIR, school.logo_filename)
         if os.path.exists(local_path):
             return local_path
         app.logger.warning(f"Logo file NOT found at local path: {local_path}")
@@ -282,18 +668,18 @@ def get_expected_fee(school_id, student_class, term, session):
 def get_total_paid_for_period(student_id, term, session):
     """
     NEW HELPER: Calculates the total amount paid by a student for a specific term and session.
-    Returns amount in Naira (Float).
+    Payments are stored in Kobo; returns amount in Naira (Float).
     """
     total = db.session.execute(
-        db.select(func.sum(Payment.amount_paid)).filter_by(
+        db.select(func.coalesce(func.sum(Payment.amount_paid), 0)).filter_by(
             student_id=student_id,
             term=term,
             session=session
         )
-    ).scalar_one_or_none()
+    ).scalar_one()
     
-    # Total is already in Naira (Float)
-    return total if total is not None else 0.0
+    # Total is in Kobo, divide by 100 for Naira (Float)
+    return total / 100.0
 
 
 def handle_logo_upload(school):
@@ -309,28 +695,41 @@ def handle_logo_upload(school):
         flash("Invalid file type. Please upload a PNG or JPG.", "danger")
         return False
     
-    # Construct filename using school ID and name, then secure it
-    ext = file.filename.rsplit('.', 1)[1].lower()
+    # Construct filename using school ID and name, then secure it. Each upload gets
+    # a new name, so the filename doubles as the logo's version for cached
+    # receipts/ImageReaders (no mtime stat needed). Logos are always stored as PNG.
     safe_name = secure_filename(school.name.lower().replace(' ', '_'))
-    filename = f"{school.id}_{safe_name}.{ext}"
-    file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+    filename = f"{school.id}_{safe_name}_{secrets.token_hex(4)}.png"
+    file_path = os.path.join(LOGO_DIR, filename)
     
     try:
-        file_content = file.read()
-        
-        # Basic validation using PIL
-        with Image.open(BytesIO(file_content)) as img:
-            img_format = img.format.upper()
-            if img_format not in ("JPEG", "PNG"):
-                flash("Invalid image content. File is not a valid JPEG or PNG.", "danger")
-                return False
-                
-        # Save the file
-        with open(file_path, "wb") as f:
-            f.write(file_content)
+        # Read straight from the upload stream (no in-memory copy). Only the
+        # JPEG/PNG header parsers are tried.
+        try:
+            img = Image.open(file.stream, formats=ALLOWED_IMAGE_FORMATS)
+        except UnidentifiedImageError:
+            flash("Invalid image content. File is not a valid JPEG or PNG.", "danger")
+            return False
+
+        # Downscale once at upload so the dashboard and receipts only ever load a
+        # small image. thumbnail() decodes JPEGs at reduced scale (draft mode) and
+        # fails on truncated/corrupt files, which replaces the old verify() pass.
+        with img:
+            img.thumbnail(LOGO_MAX_SIZE)
+            logo = img if img.mode in ("RGB", "RGBA") else img.convert("RGBA")
+            logo.save(file_path, "PNG", optimize=True)
             
+        old_filename = school.logo_filename
         school.logo_filename = filename
         db.session.commit()
+        invalidate_school_cache(school.id, "dash")
+
+        # Remove the previous logo now that nothing references it
+        if old_filename and old_filename != filename:
+            try:
+                os.remove(os.path.join(LOGO_DIR, secure_filename(old_filename)))
+            except OSError:
+                pass
         flash("Logo uploaded successfully!", "success")
         return True
     except Exception as e:
@@ -338,15 +737,50 @@ def handle_logo_upload(school):
         flash(f"Error processing image: {e}", "danger")
         return False
 
+def verify_subscription_payment(school, reference):
+    """
+    Verifies a Paystack transaction and, on success, extends the school's
+    subscription by one year. Returns True if the payment was verified.
+    Raises requests.exceptions.RequestException on API errors.
+    """
+    paystack_verify_url = f"https://api.paystack.co/transaction/verify/{reference}"
+
+    response = paystack_session.get(paystack_verify_url, timeout=PAYSTACK_TIMEOUT)
+    response.raise_for_status()
+    res_data = response.json()
+
+    if res_data["status"] and res_data["data"]["status"] == "success":
+        extend_subscription(school.id)
+        return True
+    return False
+
+def extend_subscription(school_id):
+    """
+    Sets the school's subscription to expire one year from today and commits.
+    Idempotent for the same day, so the callback and the webhook may both apply it.
+    Returns the new expiry date, or None if the school does not exist.
+    """
+    # A single UPDATE ... RETURNING: no flush of a loaded object and no re-SELECT
+    expiry = db.session.execute(
+        db.update(School)
+        .where(School.id == school_id)
+        .values(subscription_expiry=today() + timedelta(days=365))
+        .returning(School.subscription_expiry)
+    ).scalar_one_or_none()
+    db.session.commit()
+    if expiry is not None:
+        invalidate_school_cache(school_id, "dash")
+    return expiry
+
 def create_new_payment(form_data, student):
     """Creates a new Payment record and commits it to the database."""
     try:
-        # Amount expected to be in Naira (or primary currency unit)
-        amount = float(form_data.get("amount") or form_data.get("amount_paid"))
-        if amount <= 0:
+        # Amount is entered in Naira (or primary currency unit), stored in Kobo
+        amount_kobo = naira_to_kobo(form_data.get("amount") or form_data.get("amount_paid"))
+        if amount_kobo <= 0:
             flash("Amount must be greater than zero.", "danger")
             return None
-    except (TypeError, ValueError):
+    except ValueError:
         flash("Invalid amount.", "danger")
         return None
     
@@ -354,12 +788,12 @@ def create_new_payment(form_data, student):
     session_year = form_data.get("session", "").strip()
     payment_type = form_data.get("payment_type", "").strip()
     
-    if not all([amount, term, session_year, payment_type]):
+    if not all([amount_kobo, term, session_year, payment_type]):
         flash("All payment fields are required.", "danger")
         return None
-        
+
     payment = Payment(
-        amount_paid=amount,
+        amount_paid=amount_kobo,
         payment_date=datetime.utcnow(),
         term=term,
         session=session_year,
@@ -368,8 +802,45 @@ def create_new_payment(form_data, student):
     )
     db.session.add(payment)
     db.session.commit()
+    invalidate_school_cache(student.school_id, "dash")
     return payment
 
+def insert_or_ignore(model, index_elements=None, **values):
+    """
+    Inserts a row with INSERT ... ON CONFLICT DO NOTHING RETURNING id, so the
+    duplicate check and the insert are a single, race-free round trip.
+
+    Returns:
+        The new row's id, or None if a unique constraint already matched.
+    """
+    insert = pg_insert if db.engine.dialect.name == "postgresql" else sqlite_insert
+    stmt = (
+        insert(model)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=index_elements)
+        .returning(model.id)
+    )
+    return db.session.execute(stmt).scalar_one_or_none()
+
+def insert_many_or_ignore(model, rows, index_elements=None):
+    """
+    Bulk version of insert_or_ignore: inserts all `rows` (dicts of column values)
+    as batched multi-row INSERT ... ON CONFLICT DO NOTHING statements (SQLAlchemy's
+    insertmanyvalues), instead of one round trip per row.
+
+    Returns:
+        The number of rows actually inserted (conflicting rows are skipped).
+    """
+    if not rows:
+        return 0
+    insert = pg_insert if db.engine.dialect.name == "postgresql" else sqlite_insert
+    stmt = (
+        insert(model)
+        .on_conflict_do_nothing(index_elements=index_elements)
+        .returning(model.id)
+    )
+    return len(db.session.execute(stmt, rows).all())
+
 def _clean_and_convert_amount(raw_amount):
     """
     Cleans a user-input currency string (like '₦50,000' or '50.000')
@@ -388,56 +859,13 @@ def _clean_and_convert_amount(raw_amount):
     if not cleaned:
         raise ValueError("Amount empty after cleaning")
 
-    try:
-        # Convert to float (handles both '50.000' and '50,000')
-        amount_naira = float(cleaned.replace(",", ""))
-    except ValueError:
-        raise ValueError(f"Invalid number format: {raw_amount}")
+    # Exact Decimal conversion (handles both '50.000' and '50,000'); raises ValueError
+    expected_amount_kobo = naira_to_kobo(cleaned.replace(",", ""))
 
-    if amount_naira <= 0:
+    if expected_amount_kobo <= 0:
         raise ValueError("Amount must be greater than zero")
 
-    expected_amount_kobo = int(round(amount_naira * 100))
-    return expected_amount_kobo, amount_naira
-
-def calculate_total_outstanding_dynamic(school):
-    """
-    Calculates the total outstanding balance across all students.
-    
-    Dynamically sums all expected fees (Kobo -> Naira) and subtracts all total payments (Naira).
-    Returns the result in Naira (float).
-    """
-    total_outstanding_naira = 0.0
-    students = Student.query.filter_by(school_id=school.id).all()
-    
-    for student in students:
-        # 1. Get ALL Expected Fees for this student's class (case-insensitive fix)
-        # Note: We look up all fee structures to get the total expected fees for the life of the student/class
-        fee_structures = FeeStructure.query.filter(
-            FeeStructure.school_id == school.id,
-            FeeStructure.class_name.ilike(student.student_class)
-        ).all()
-        
-        total_expected_naira = 0.0
-        for fee in fee_structures:
-            # Expected Fee is stored in KOBO, so divide by 100.0 to get Naira
-            total_expected_naira += float(fee.expected_amount) / 100.0
-
-        # 2. Get ALL Payments made by this student (Payments stored in Naira)
-        total_paid_naira = db.session.query(db.func.sum(Payment.amount_paid)).filter(
-            Payment.student_id == student.id
-        ).scalar() or 0
-        total_paid_naira = float(total_paid_naira)
-        
-        # 3. Calculate individual outstanding (Only accumulate positive balances)
-        outstanding_naira = total_expected_naira - total_paid_naira
-        
-        if outstanding_naira > 0:
-            total_outstanding_naira += outstanding_naira
-
-    return total_outstanding_naira
-
-
+    return expected_amount_kobo, expected_amount_kobo / 100.0
 
 # ---------------------------
 # TEMPLATE FILTERS (for display)
@@ -469,6 +897,22 @@ def naira_format_filter(value_naira):
 # ---------------------------
 # ERROR HANDLERS
 # ---------------------------
+@app.errorhandler(413)
+def request_entity_too_large(e):
+    """
+    Handles uploads over MAX_CONTENT_LENGTH (413): flash and send the user back
+    to the form instead of showing a bare error page.
+    """
+    max_mb = app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)
+    flash(f"File is too large. Please upload an image under {max_mb} MB.", "danger")
+    return redirect(request.referrer or url_for("settings"))
+
+@app.errorhandler(429)
+def too_many_requests(e):
+    """Handles rate-limited requests (429), e.g. repeated failed logins."""
+    flash("Too many attempts. Please wait a minute and try again.", "danger")
+    return redirect(url_for("index"))
+
 @app.errorhandler(500)
 def internal_server_error(e):
     """
@@ -478,18 +922,39 @@ def internal_server_error(e):
     # Assume you have a 500.html template
     return render_template('500.html'), 500
 
+@app.after_request
+def cache_static_logos(response):
+    """
+    Uploaded logos get a fresh filename on every upload, so a given logo URL never
+    changes content and browsers may keep it for a year without revalidating.
+    """
+    if request.endpoint == "static" and response.status_code in (200, 304):
+        if request.view_args.get("filename", "").startswith("logos/"):
+            response.cache_control.public = True
+            response.cache_control.max_age = 31536000
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+    return response
+
 # ---------------------------
 # AUTH
 # ---------------------------
 @app.route("/", methods=["GET", "POST"])
+@limiter.limit("20 per minute", methods=["POST"])
 def index():
     """Handles school login."""
     if request.method == "POST":
         email = request.form.get("email", "").strip()
         password = request.form.get("password", "")
         school = School.query.filter_by(email=email).first()
+        # Always run one hash verify, even for unknown emails (constant-time login)
+        password_ok = verify_password(school.password if school else DUMMY_PASSWORD_HASH, password)
         
-        if school and check_password_hash(school.password, password):
+        if school and password_ok:
+            # Upgrade legacy PBKDF2 hashes to Argon2id on successful login
+            if password_needs_rehash(school.password):
+                school.password = hash_password(password)
+                db.session.commit()
             session["school_id"] = school.id
             flash(f"Welcome back, {school.name}!", "success")
             return redirect(url_for("dashboard"))
@@ -505,26 +970,27 @@ def register():
         name = request.form.get("school_name", "").strip()
         email = request.form.get("email", "").strip()
         password = request.form.get("password", "")
-        if School.query.filter((School.email == email) | (School.name == name)).first():
-            flash("School already exists!", "danger")
-            return redirect(url_for("register"))
-            
         if len(password) < 8:
             flash("Password must be at least 8 characters long.", "danger")
             return redirect(url_for("register"))
             
-        hashed_pw = generate_password_hash(password)
+        hashed_pw = hash_password(password)
         
         # KEY UPDATE: Give a trial period of exactly 1 day from today
-        initial_expiry = datetime.today().date() + timedelta(days=1) 
+        initial_expiry = today() + timedelta(days=1) 
         
-        school = School(
+        # The unique email/name constraints do the duplicate check inside the INSERT
+        school_id = insert_or_ignore(
+            School,
             name=name,
             email=email,
             password=hashed_pw,
             subscription_expiry=initial_expiry,
         )
-        db.session.add(school)
+        if school_id is None:
+            db.session.rollback()
+            flash("School already exists!", "danger")
+            return redirect(url_for("register"))
         db.session.commit()
         flash("School registered successfully! Enjoy your 1-day trial.", "success")
         return redirect(url_for("index")) # Redirect to login after successful registration
@@ -538,44 +1004,59 @@ def logout():
     return redirect(url_for("index"))
 
 # --- HELPER FUNCTION: DYNAMIC OUTSTANDING CALCULATION ---
-# This function is necessary to calculate the outstanding balance by comparing 
-# the Kobo-based FeeStructure amounts with the Naira-based Payment amounts.
-def calculate_total_outstanding_dynamic(school):
+# The outstanding balance compares the Kobo-based FeeStructure amounts with the
+# Kobo-based Payment amounts. It is computed in SQL so bulk views can filter,
+# sort and paginate on the balance without loading every student and payment.
+def positive_balance(expected_kobo, paid_kobo):
+    """SQL expression for max(0, expected - paid); portable (GREATEST isn't available on SQLite)."""
+    return db.case((expected_kobo > paid_kobo, expected_kobo - paid_kobo), else_=0)
+
+def student_balances_subquery(school_id):
     """
-    Calculates the total outstanding balance across all students.
-    
-    Dynamically sums all expected fees (Kobo -> Naira) and subtracts all total payments (Naira).
-    Returns the result in Naira (float).
+    Returns a subquery with one row per student of the school:
+    student_id, expected_kobo, paid_kobo and outstanding_kobo.
+
+    expected_kobo sums ALL fee structures for the student's class (case-insensitive),
+    paid_kobo is ALL payments made by the student (the trigger-maintained Student.total_paid_kobo).
     """
-    # Assuming School, Student, Payment, FeeStructure models and db are globally available.
-    total_outstanding_naira = 0.0
-    students = Student.query.filter_by(school_id=school.id).all()
-    
-    for student in students:
-        # 1. Get ALL Expected Fees for this student's class (case-insensitive fix)
-        fee_structures = FeeStructure.query.filter(
-            FeeStructure.school_id == school.id,
-            FeeStructure.class_name.ilike(student.student_class)
-        ).all()
-        
-        total_expected_naira = 0.0
-        for fee in fee_structures:
-            # Expected Fee is stored in KOBO, so divide by 100.0 to get Naira
-            total_expected_naira += float(fee.expected_amount) / 100.0
-
-        # 2. Get ALL Payments made by this student (Payments stored in Naira)
-        total_paid_naira = db.session.query(db.func.sum(Payment.amount_paid)).filter(
-            Payment.student_id == student.id
-        ).scalar() or 0
-        total_paid_naira = float(total_paid_naira)
-        
-        # 3. Calculate individual outstanding (Only accumulate positive balances)
-        outstanding_naira = total_expected_naira - total_paid_naira
-        
-        if outstanding_naira > 0:
-            total_outstanding_naira += outstanding_naira
+    expected_kobo = (
+        db.select(db.func.coalesce(db.func.sum(FeeStructure.expected_amount), 0))
+        .where(
+            FeeStructure.school_id == Student.school_id,
+            db.func.lower(FeeStructure.class_name) == db.func.lower(Student.student_class)
+        )
+        .scalar_subquery()
+    )
+    paid_kobo = Student.total_paid_kobo
+    return (
+        db.select(
+            Student.id.label("student_id"),
+            expected_kobo.label("expected_kobo"),
+            paid_kobo.label("paid_kobo"),
+            (expected_kobo - paid_kobo).label("outstanding_kobo"),
+        )
+        .where(Student.school_id == school_id)
+        .subquery("student_balance")
+    )
 
-    return total_outstanding_naira
+def calculate_school_totals(school):
+    """
+    Returns (student_count, total_paid_kobo, total_outstanding_kobo) for the school,
+    all ALL-TIME figures, from a single aggregate query over the per-student balances.
+
+    Only positive balances count towards the outstanding total, so overpayments
+    do not reduce what other students owe.
+    """
+    balances = student_balances_subquery(school.id)
+    outstanding = balances.c.outstanding_kobo
+    student_count, paid_kobo, outstanding_kobo = db.session.execute(
+        db.select(
+            db.func.count(balances.c.student_id),
+            db.func.coalesce(db.func.sum(balances.c.paid_kobo), 0),
+            db.func.coalesce(db.func.sum(db.case((outstanding > 0, outstanding), else_=0)), 0),
+        )
+    ).one()
+    return student_count, int(paid_kobo), int(outstanding_kobo)
 
 # ---------------------------
 # DASHBOARD (TOTAL PAYMENTS & OUTSTANDING = ALL-TIME DEFAULT)
@@ -583,6 +1064,10 @@ def calculate_total_outstanding_dynamic(school):
 @app.route("/dashboard")
 @login_required
 @trial_required
+# Every write that changes a dashboard figure (payments, students, fees, school
+# details, subscription) calls invalidate_school_cache(..., "dash"), so the TTL only
+# bounds how late the date-based subscription status can flip.
+@cache.cached(timeout=300, key_prefix=school_cache_key("dash"), unless=skip_response_cache)
 def dashboard():
     school = current_school()
     if not school:
@@ -592,32 +1077,15 @@ def dashboard():
     # Removed: current_term, current_session variables as they are no longer needed
     # for the Total Payments calculation.
 
-    total_students = Student.query.filter_by(school_id=school.id).count()
-
-    # 1. Calculate TOTAL Payments (ALL-TIME) 💰
-    # Filtered only by school_id to get the historical total.
-    total_payments_naira = (
-        db.session.query(db.func.sum(Payment.amount_paid))
-        .join(Student)
-        .filter(
-            Student.school_id == school.id
-        )
-        .scalar()
-    ) or 0
-    # Convert payments from Naira (Float) to Kobo (Integer) for template display
-    total_payments_kobo = int(float(total_payments_naira) * 100)
-
-    # 2. Calculate Outstanding Balance (ALL-TIME default) 
-    # This calculation uses the helper function, which defaults to All-Time
-    # when no term/session filters are provided.
-    total_outstanding_naira = calculate_total_outstanding_dynamic(school)
-    
-    # Convert final outstanding balance to KOBO for template display
-    outstanding_balance_kobo = int(round(total_outstanding_naira * 100))
+    # 1 & 2. Student count, TOTAL Payments and Outstanding Balance (ALL-TIME) 💰
+    # in a single round trip. Filtered only by school_id to get the historical totals;
+    # the sums are already in KOBO, as the template expects.
+    total_students, total_payments_kobo, outstanding_balance_kobo = calculate_school_totals(school)
 
-    # 3. Recent Payments
+    # 3. Recent Payments (student eager-loaded: the template renders p.student.name)
     recent_payments = (
-        Payment.query.join(Student)
+        Payment.query.options(joinedload(Payment.student), raiseload("*"))
+        .join(Student)
         .filter(Student.school_id == school.id)
         .order_by(Payment.payment_date.desc())
         .limit(5)
@@ -625,7 +1093,7 @@ def dashboard():
     )
 
     # KEY UPDATE: Check if the subscription is active based on the expiry date
-    subscription_active = school.subscription_expiry >= datetime.today().date()
+    subscription_active = school.subscription_expiry >= today()
 
     return render_template(
         "dashboard.html",
@@ -656,9 +1124,8 @@ def settings():
         
         # 2. Process Expected Total Fees 
         try:
-            expected_naira = float(request.form.get('expected_fees_this_term', 0))
-            # Rounding to prevent floating point errors before converting to int for kobo
-            school.expected_fees_this_term = int(round(expected_naira * 100))
+            # Decimal conversion, so no floating point rounding before storing kobo
+            school.expected_fees_this_term = naira_to_kobo(request.form.get('expected_fees_this_term', 0))
         except ValueError:
             flash("Invalid fee amount entered.", "danger")
             return redirect(url_for('settings'))
@@ -669,6 +1136,7 @@ def settings():
 
         # 4. Commit standard changes to the database
         db.session.commit()
+        invalidate_school_cache(school.id, "dash")
         flash("School settings updated successfully!", "success")
         
         # Redirect after POST to prevent resubmission on refresh
@@ -701,11 +1169,10 @@ def students():
     if request.method == "POST":
         # Note: We must count ALL students here (including soft-deleted) to enforce the limit
         # This prevents bypassing the limit by deleting students.
-        student_count = Student.query.filter_by(school_id=school.id).count()
         subscription_endpoint = 'pay_with_paystack_subscription'
         
         # KEY UPDATE: Enforce the student count limit after the trial expiry date
-        if school.subscription_expiry < datetime.today().date() and student_count >= current_app.config['TRIAL_LIMIT']:
+        if school.subscription_expiry < today() and trial_limit_reached(school):
             flash(f"Your subscription has expired. Please renew to add more than {current_app.config['TRIAL_LIMIT']} students.", "danger")
             return redirect(url_for(subscription_endpoint))
             
@@ -716,30 +1183,44 @@ def students():
         if not all([name, reg_number, student_class]):
             flash("All fields are required.", "danger")
         else:
-            # Check for existing student (including soft-deleted ones)
-            existing_student = Student.query.filter_by(school_id=school.id, reg_number=reg_number).first()
-            if existing_student:
+            # Insert unless the reg number exists (including soft-deleted students);
+            # the (school_id, reg_number) unique constraint does the check in one round trip
+            student_id = insert_or_ignore(
+                Student,
+                index_elements=["school_id", "reg_number"],
+                name=name,
+                reg_number=reg_number,
+                student_class=student_class,
+                school_id=school.id,
+            )
+            if student_id is None:
+                db.session.rollback()
                 flash(f"Student with registration number '{reg_number}' already exists.", "danger")
             else:
-                student = Student(
-                    name=name,
-                    reg_number=reg_number,
-                    student_class=student_class,
-                    school_id=school.id,
-                )
-                db.session.add(student)
                 db.session.commit()
+                invalidate_school_cache(school.id, "dash", "search")
                 flash("Student added successfully.", "success")
         return redirect(url_for("students"))
         
-    # Query to fetch ACTIVE students only (is_deleted=False) for the list view
-    students_list = Student.query.filter_by(school_id=school.id, is_deleted=False).order_by(Student.name).all()
-    
-    # Calculate the count based on ALL students for the limit check/display logic
-    student_count_all = Student.query.filter_by(school_id=school.id).count()
+    # Query to fetch ACTIVE students only (is_deleted=False) for the list view.
+    # Only the rendered columns are selected: plain rows, no ORM objects to build/track
+    # (the template's student.name etc. work the same on rows).
+    students_list = db.session.execute(
+        db.select(Student.id, Student.name, Student.reg_number, Student.student_class)
+        .where(Student.school_id == school.id, Student.is_deleted == False)
+        .order_by(Student.name)
+    ).all()
     
     # Logic for display banner: trial active if time hasn't expired OR ALL student count is below limit.
-    trial_active = school.subscription_expiry >= datetime.today().date() or student_count_all < current_app.config['TRIAL_LIMIT']
+    trial_active = school.subscription_expiry >= today() or not trial_limit_reached(school)
+    
+    # The full count (ALL students) is only displayed on the expired/limit banner
+    student_count_all = None
+    if not trial_active:
+        # Plain COUNT(*) (Query.count() wraps the full entity SELECT in a subquery)
+        student_count_all = db.session.scalar(
+            db.select(db.func.count()).select_from(Student).where(Student.school_id == school.id)
+        )
     
     return render_template("students.html", 
                            students=students_list, 
@@ -748,6 +1229,59 @@ def students():
                            trial_active=trial_active)
 
 
+@app.route("/students/import", methods=["POST"])
+@login_required
+@trial_required
+def import_students():
+    """
+    Bulk-adds students from an uploaded CSV with name, reg_number and student_class
+    columns. All rows are inserted in batches with a single commit; registration
+    numbers that already exist (including soft-deleted students) are skipped.
+    """
+    school = current_school()
+    file = request.files.get("file")
+    if not file or not file.filename.lower().endswith(".csv"):
+        flash("Please upload a CSV file.", "danger")
+        return redirect(url_for("students"))
+
+    rows = []
+    invalid = 0
+    try:
+        # Decoded straight from the upload stream; utf-8-sig drops Excel's BOM
+        for line in csv.DictReader(TextIOWrapper(file.stream, encoding="utf-8-sig")):
+            values = {key: (line.get(key) or "").strip() for key in ("name", "reg_number", "student_class")}
+            if not all(values.values()):
+                invalid += 1
+                continue
+            rows.append(dict(values, school_id=school.id))
+    except (UnicodeDecodeError, csv.Error) as e:
+        app.logger.error(f"Invalid student import file: {e}")
+        flash("Could not read the file. Please upload a UTF-8 CSV with name, reg_number and student_class columns.", "danger")
+        return redirect(url_for("students"))
+
+    if not rows:
+        flash("No valid student rows found. Required columns: name, reg_number, student_class.", "danger")
+        return redirect(url_for("students"))
+
+    try:
+        inserted = insert_many_or_ignore(Student, rows, index_elements=["school_id", "reg_number"])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error importing students: {e}")
+        flash("An error occurred while importing students. No students were added.", "danger")
+        return redirect(url_for("students"))
+
+    invalidate_school_cache(school.id, "dash", "search")
+    skipped = len(rows) - inserted
+    flash(
+        f"Imported {inserted} student(s). Skipped {skipped} existing registration number(s)"
+        f" and {invalid} incomplete row(s).",
+        "success"
+    )
+    return redirect(url_for("students"))
+
+
 # ---------------------------
 # EDIT STUDENT (Fixes password attribute name)
 # ---------------------------
@@ -769,7 +1303,7 @@ def edit_student(student_id):
         
         # === PASSWORD VERIFICATION CHECK ===
         # 💥 FIX HERE: Changed 'password_hash' to 'password' based on error
-        if not admin_password or not check_password_hash(admin_user.password, admin_password):
+        if not admin_password or not verify_password(admin_user.password, admin_password):
             flash("Authorization Failed: Incorrect admin password. Changes were not saved.", "danger")
             return render_template("edit_student.html", student=student)
 
@@ -779,16 +1313,16 @@ def edit_student(student_id):
             reg_number = request.form.get("reg_number").strip()
             student_class = request.form.get("student_class").strip()
 
-            # Check if the new reg_number is unique among other ACTIVE students
+            # Check if the new reg_number is unique among the school's other students,
+            # including soft-deleted ones: _school_reg_uc covers them too
             existing_reg = Student.query.filter(
                 Student.school_id == school.id,
                 Student.reg_number == reg_number,
-                Student.id != student_id,
-                Student.is_deleted == False 
+                Student.id != student_id
             ).first()
 
             if existing_reg:
-                flash(f"Registration number '{reg_number}' is already in use by another active student.", "danger")
+                flash(f"Registration number '{reg_number}' is already in use by another student (including deleted students).", "danger")
                 return render_template("edit_student.html", student=student)
 
             student.name = name
@@ -796,6 +1330,7 @@ def edit_student(student_id):
             student.student_class = student_class
             
             db.session.commit()
+            invalidate_school_cache(school.id, "dash", "search")
             flash(f"Student {student.name}'s details updated successfully.", "success")
             return redirect(url_for("students"))
 
@@ -819,7 +1354,7 @@ def delete_student(student_id):
     admin_password = request.form.get("admin_password") 
     
     # === PASSWORD VERIFICATION CHECK ===
-    if not admin_password or not check_password_hash(admin_user.password_hash, admin_password):
+    if not admin_password or not verify_password(admin_user.password, admin_password):
         flash("Authorization Failed: Incorrect admin password. Deletion cancelled.", "danger")
         return redirect(url_for("students"))
 
@@ -828,6 +1363,7 @@ def delete_student(student_id):
         student_name = student.name
         student.is_deleted = True  # Soft Delete: Set the flag
         db.session.commit()
+        invalidate_school_cache(school.id, "search")
         
         flash(f"Student {student_name} has been successfully deactivated (soft-deleted). Their payment history is preserved.", "warning")
         return redirect(url_for("students"))
@@ -844,12 +1380,17 @@ def delete_student(student_id):
 @app.route("/search-students", methods=["GET"])
 @login_required
 @trial_required # NEW: Enforce time-based trial restriction
+@browser_revalidated
+@cache.cached(timeout=60, key_prefix=search_cache_key)
 def search_students():
     school = current_school()
     query = request.args.get("q", "").strip()
     students = []
     if len(query) >= 2:
-        students = Student.query.filter(
+        # Select only the returned columns (plain rows, no ORM object hydration)
+        students = db.session.query(
+            Student.id, Student.name, Student.reg_number, Student.student_class
+        ).filter(
             Student.school_id == school.id,
             db.or_(
                 Student.name.ilike(f"%{query}%"),
@@ -867,35 +1408,55 @@ def student_financials():
     term = request.args.get("term", "").strip()
     session_year = request.args.get("session", "").strip()
     school = current_school()
-    student = db.session.get(Student, student_id)
-    if not student or student.school_id != school.id:
-        return jsonify(error="Student not found or access denied."), 404
-    
-    # 1. Get expected fee from FeeStructure (in kobo/cents)
-    fee_structure = FeeStructure.query.filter_by(
-        school_id=school.id,
-        class_name=student.student_class
+
+    # 1. Expected fee from FeeStructure (in kobo/cents) for the student's class
+    expected_amount_subq = (
+        db.select(FeeStructure.expected_amount)
+        .where(
+            FeeStructure.school_id == Student.school_id,
+            FeeStructure.class_name == Student.student_class
+        )
+        .limit(1)
+        .scalar_subquery()
+    )
+    # 2. Total paid for this term/session (Payment.amount_paid is in kobo/cents)
+    total_paid_subq = (
+        db.select(db.func.coalesce(db.func.sum(Payment.amount_paid), 0))
+        .where(
+            Payment.student_id == Student.id,
+            Payment.term == term,
+            Payment.session == session_year
+        )
+        .scalar_subquery()
+    )
+    figures = (
+        db.select(
+            db.func.coalesce(expected_amount_subq, 0).label("expected_kobo"),
+            total_paid_subq.label("paid_kobo")
+        ).where(
+            Student.id == student_id,
+            Student.school_id == school.id
+        )
+        .subquery()
+    )
+    # 3. Outstanding (in kobo/cents), never negative. Access check, fee lookup,
+    # payment total and balance all come back in a single round trip.
+    row = db.session.execute(
+        db.select(
+            figures.c.expected_kobo,
+            figures.c.paid_kobo,
+            positive_balance(figures.c.expected_kobo, figures.c.paid_kobo)
+        )
     ).first()
-    expected_amount_kobo = fee_structure.expected_amount if fee_structure else 0
-    
-    # 2. Calculate total paid for this term/session (Payment.amount_paid is Naira/Primary Currency)
-    total_paid_naira_query = db.session.query(db.func.sum(Payment.amount_paid)).filter_by(
-        student_id=student.id,
-        term=term,
-        session=session_year
-    ).scalar()
-    total_paid_naira = total_paid_naira_query or 0.0
-    total_paid_kobo = int(total_paid_naira * 100)
-    
-    # 3. Calculate outstanding (in kobo/cents)
-    outstanding_kobo = expected_amount_kobo - total_paid_kobo
-    outstanding_kobo = max(0, outstanding_kobo)
+    if row is None:
+        return jsonify(error="Student not found or access denied."), 404
+    expected_amount_kobo, total_paid_kobo, outstanding_kobo = row
     
     # Convert back to Naira for client-side display in API response
     return jsonify({
         # NOTE: Returning kobo/100 for client display in Naira
         "total_fee": expected_amount_kobo / 100.0, 
-        "total_paid": total_paid_naira,
+        "total_paid": total_paid_kobo / 100.0,
         "outstanding": outstanding_kobo / 100.0 
     })
 
@@ -916,8 +1477,8 @@ def get_student_payments(student_id):
     
     payments_data = [{
         "id": p.id,
-        "amount_paid": p.amount_paid,
-        "date": p.payment_date.isoformat(), # Use ISO format for JS compatibility
+        "amount_paid": p.amount_paid / 100.0, # Kobo -> Naira for client display
+        "date": p.payment_date, # orjson emits ISO 8601 natively (JS-compatible)
         "term": p.term,
         "session": p.session
     } for p in payments]
@@ -936,32 +1497,29 @@ def pay_with_paystack_subscription():
     # If the request is a GET, render the page.
     if request.method == "GET":
         # Check if they are already subscribed
-        is_subscribed = school.subscription_expiry >= datetime.today().date()
+        is_subscribed = school.subscription_expiry >= today()
         
         return render_template(
             "subscription.html",
             school=school,
             subscription_amount=app.config['PAYSTACK_SUBSCRIPTION_AMOUNT'] / 100, # Convert kobo to NGN
-            today=datetime.today().date(),
+            today=today(),
             is_subscribed=is_subscribed
         )
 
     # If the request is a POST, initialize payment.
     paystack_api_url = "https://api.paystack.co/transaction/initialize"
-    headers = {
-        "Authorization": f"Bearer {app.config['PAYSTACK_SECRET_KEY']}",
-        "Content-Type": "application/json"
-    }
     payload = {
         "email": school.email,
         "amount": app.config['PAYSTACK_SUBSCRIPTION_AMOUNT'],
         "currency": "NGN",
-        "reference": f"SP-SUB-{datetime.utcnow().timestamp()}",
+        # Random suffix: unique even for concurrent initializations, unlike a timestamp
+        "reference": f"SP-SUB-{school.id}-{secrets.token_hex(8)}",
         "callback_url": url_for("paystack_callback", _external=True)
     }
     
     try:
-        response = requests.post(paystack_api_url, headers=headers, data=json.dumps(payload))
+        response = paystack_session.post(paystack_api_url, json=payload, timeout=PAYSTACK_TIMEOUT)
         response.raise_for_status()
         res_data = response.json()
 
@@ -985,18 +1543,17 @@ def paystack_callback():
         flash("Invalid payment callback.", "danger")
         return redirect(url_for("pay_with_paystack_subscription")) 
     
-    paystack_verify_url = f"https://api.paystack.co/transaction/verify/{reference}"
-    headers = {"Authorization": f"Bearer {app.config['PAYSTACK_SECRET_KEY']}"}
+    if task_queue is not None:
+        # Verify in the background so this request returns immediately; the page
+        # polls paystack_status until the worker has heard back from Paystack
+        job = task_queue.enqueue("tasks.verify_paystack", reference, school.id)
+        return render_template(
+            "paystack_verifying.html",
+            status_url=url_for("paystack_status", job_id=job.id)
+        )
 
     try:
-        response = requests.get(paystack_verify_url, headers=headers)
-        response.raise_for_status()
-        res_data = response.json()
-
-        if res_data["status"] and res_data["data"]["status"] == "success":
-            # Add 1 year to the subscription expiry date
-            school.subscription_expiry = datetime.today().date() + timedelta(days=365)
-            db.session.commit()
+        if verify_subscription_payment(school, reference):
             flash("Subscription renewed successfully! You now have full access.", "success")
         else:
             flash("Subscription payment failed or was not verified.", "danger")
@@ -1007,6 +1564,73 @@ def paystack_callback():
     
     return redirect(url_for("dashboard")) # Redirect to dashboard after successful payment
 
+@app.route("/paystack/status/<job_id>", methods=["GET"])
+@login_required
+# NOTE: Not wrapped in @trial_required either: it is polled while the renewal is pending
+def paystack_status(job_id):
+    """JSON status of a background Paystack verification, polled by paystack_verifying.html."""
+    school = current_school()
+    job = fetch_job(job_id) if task_queue is not None else None
+    # Job args are (reference, school_id): only the owning school may poll it
+    if job is None or job.func_name != "tasks.verify_paystack" or job.args[1] != school.id:
+        return jsonify(error="Verification job not found."), 404
+
+    data = {"status": job.get_status()}
+    if job.is_finished:
+        data["verified"] = bool(job.result)
+        if job.result:
+            flash("Subscription renewed successfully! You now have full access.", "success")
+            data["redirect_url"] = url_for("dashboard")
+        else:
+            data["redirect_url"] = url_for("pay_with_paystack_subscription")
+    return jsonify(data)
+
+@app.route("/paystack/webhook", methods=["POST"])
+def paystack_webhook():
+    """
+    Paystack's server-to-server charge notification. The x-paystack-signature
+    header (HMAC-SHA512 of the raw body with the secret key) is checked locally,
+    so the subscription is renewed without an outbound verify call, even if the
+    user never returns to the callback URL.
+    """
+    body = request.get_data()
+    signature = request.headers.get("x-paystack-signature", "")
+    secret_key = app.config["PAYSTACK_SECRET_KEY"]
+    if not secret_key:
+        return jsonify(error="Webhook not configured."), 503
+    expected = hmac.new(secret_key.encode(), body, hashlib.sha512).hexdigest()
+    if not hmac.compare_digest(expected, signature):
+        return jsonify(error="Invalid signature."), 401
+
+    # Malformed payloads are treated as non-matching events: a signed event must
+    # always get its 200, or Paystack keeps retrying it
+    try:
+        event = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        app.logger.warning("Paystack webhook with an unparseable body ignored.")
+        event = {}
+    if not isinstance(event, dict):
+        event = {}
+    data = event.get("data") if isinstance(event.get("data"), dict) else {}
+    reference = data.get("reference") if isinstance(data.get("reference"), str) else ""
+    amount = data.get("amount")
+    # Subscription references are SP-SUB-<school_id>-<token>; other charges are ignored
+    parts = reference.split("-")
+    if (
+        event.get("event") == "charge.success"
+        and data.get("status") == "success"
+        and len(parts) == 4 and reference.startswith("SP-SUB-") and parts[2].isdigit()
+        # The subscription price is in kobo, so the amount only compares for NGN charges
+        and data.get("currency") == "NGN"
+        and isinstance(amount, int) and not isinstance(amount, bool)
+        and amount >= app.config["PAYSTACK_SUBSCRIPTION_AMOUNT"]
+    ):
+        if extend_subscription(int(parts[2])) is None:
+            app.logger.warning(f"Paystack webhook for unknown school in reference {reference}.")
+
+    # Acknowledge every correctly signed event so Paystack stops retrying it
+    return jsonify(status="ok")
+
 # ---------------------------
 # PAYMENTS ROUTES (UPDATED FOR FILTERING AND PAGINATION)
 # ---------------------------
@@ -1026,8 +1650,14 @@ def list_payments():
     session_year = request.args.get('session', '').strip()
 
     # --- 2. Build Base Query ---
-    # Start with all payments belonging to the current school, joining Student to filter
-    query = Payment.query.join(Student).filter(Student.school_id == school.id)
+    # Start with all payments belonging to the current school, joining Student to filter.
+    # contains_eager fills payment.student (template shows name/class) from that same
+    # JOIN; it is many-to-one, so pagination's LIMIT still counts payment rows.
+    query = (
+        Payment.query.join(Payment.student)
+        .options(contains_eager(Payment.student), raiseload("*"))
+        .filter(Student.school_id == school.id)
+    )
 
     # --- Apply Filters ---
     
@@ -1108,7 +1738,7 @@ def add_payment():
                         "message": "Payment recorded successfully!",
                         "student_name": student.name,
                         "student_class": student.student_class,
-                        "amount_paid": new_payment.amount_paid,
+                        "amount_paid": new_payment.amount_paid / 100.0, # Kobo -> Naira
                         "payment_type": new_payment.payment_type,
                         "term": new_payment.term,
                         # NOTE: Using 'payment_session' as a common SQLAlchemy field name. Check if this should be 'session'.
@@ -1157,6 +1787,442 @@ def add_payment():
     return render_template("add_payment_global.html", student=student_to_prefill)
 
 
+# ---------------------------
+# RECEIPT HELPERS
+# ---------------------------
+RECEIPT_SPOOL_MAX_SIZE = 64 * 1024 # Receipts up to 64 KB are built in memory
+
+def receipt_rows_query(school_id, *criteria):
+    """
+    Builds the query behind load_receipt/load_period_receipts: each row is
+    (payment, expected_amount_kobo, total_paid_kobo, outstanding_kobo) for the
+    school's payments matching `criteria`, with payment.student loaded from the
+    same join (so callers can filter/order on Student columns).
+    The school access check is part of the WHERE clause.
+    expected_amount_kobo is None when no fee structure matches the student's class;
+    outstanding_kobo is computed in SQL and never negative.
+    """
+    # Case-insensitive matching on class_name, written as lower() = lower() so it
+    # can use ix_fee_structure_school_class_lower (ILIKE can't)
+    expected_amount_subq = (
+        db.select(FeeStructure.expected_amount)
+        .where(
+            FeeStructure.school_id == Student.school_id,
+            db.func.lower(FeeStructure.class_name) == db.func.lower(Student.student_class)
+        )
+        .limit(1)
+        .scalar_subquery()
+    )
+    period_payment = aliased(Payment)
+    total_paid_subq = (
+        db.select(db.func.coalesce(db.func.sum(period_payment.amount_paid), 0))
+        .where(
+            period_payment.student_id == Payment.student_id,
+            period_payment.term == Payment.term,
+            period_payment.session == Payment.session
+        )
+        .scalar_subquery()
+    )
+    figures = (
+        db.select(
+            Payment.id.label("payment_id"),
+            expected_amount_subq.label("expected_kobo"),
+            total_paid_subq.label("paid_kobo")
+        )
+        .join(Payment.student)
+        .where(Student.school_id == school_id, *criteria)
+        .subquery()
+    )
+    return (
+        db.select(
+            Payment,
+            figures.c.expected_kobo,
+            figures.c.paid_kobo,
+            positive_balance(db.func.coalesce(figures.c.expected_kobo, 0), figures.c.paid_kobo)
+        )
+        .join(figures, Payment.id == figures.c.payment_id)
+        .join(Payment.student)
+        .options(contains_eager(Payment.student))
+    )
+
+def load_receipt(payment_id, school_id):
+    """
+    Loads everything a receipt needs in ONE round trip: the payment with its
+    student, the class's expected fee and the student's total paid for the
+    payment's term/session.
+
+    Returns:
+        (payment, expected_amount_kobo, total_paid_kobo, outstanding_kobo), or None
+        if the payment doesn't exist or belongs to another school.
+    """
+    row = db.session.execute(receipt_rows_query(school_id, Payment.id == payment_id)).first()
+    return tuple(row) if row else None
+
+def load_period_receipts(school_id, term, session):
+    """
+    Loads every receipt of the school for a term/session in ONE query, ordered by
+    student name then payment date. Returns a list of load_receipt() tuples.
+    """
+    rows = db.session.execute(
+        receipt_rows_query(school_id, Payment.term == term, Payment.session == session)
+        .order_by(Student.name, Payment.payment_date)
+    ).all()
+    return [tuple(row) for row in rows]
+
+@lru_cache(maxsize=64)
+def get_logo_image_reader(logo_path):
+    """
+    Returns a ReportLab ImageReader for a logo, memoized per process so the image
+    is opened and decoded once rather than on every receipt download.
+    Keyed by path alone: every upload gets a new filename (see handle_logo_upload).
+    """
+    return ImageReader(logo_path)
+
+# Layout shared by the per-school template and the per-payment overlay
+RECEIPT_LOGO_MARGIN_X = 50
+RECEIPT_TEXT_START_X = 150
+RECEIPT_LOGO_SIZE = 80
+RECEIPT_DETAILS_Y = A4[1] - 150 # Student/Payment sections (80pt apart)
+RECEIPT_AMOUNT_Y = RECEIPT_DETAILS_Y - 160 # "Amount Received", then the summary 40pt below
+
+def school_logo_path(school):
+    """Absolute path of the school's uploaded logo, or None if it has none."""
+    if not school.logo_filename:
+        return None
+    return os.path.join(LOGO_DIR, secure_filename(school.logo_filename))
+
+def draw_receipt_template(c, school):
+    """
+    Draws everything on the receipt that is the same for every payment of a
+    school: logo, title, school info, section headings, summary labels and footer.
+    """
+    width, height = A4
+
+    # --- School Logo ---
+    logo_image = None
+    logo_path = school_logo_path(school)
+    if logo_path:
+        try:
+            logo_image = get_logo_image_reader(logo_path)
+        except OSError:
+            logo_image = None # Logo file missing or unreadable
+
+    if logo_image:
+        try:
+            c.drawImage(
+                logo_image, 
+                RECEIPT_LOGO_MARGIN_X, 
+                height - 20 - RECEIPT_LOGO_SIZE, 
+                width=RECEIPT_LOGO_SIZE, 
+                height=RECEIPT_LOGO_SIZE, 
+                preserveAspectRatio=True, 
+                anchor='n'
+            )
+        except Exception as e:
+            logging.error(f"Failed to draw logo onto PDF: {e}")
+
+    # Text is batched into a few text objects (one BT/ET block each) instead of
+    # a drawString per line; each textLine() steps down by the current leading.
+
+    # Title and School Info
+    header = c.beginText(RECEIPT_TEXT_START_X, height - 50)
+    header.setFont("Helvetica-Bold", 16, leading=20)
+    header.textLine("Official School Fee Receipt")
+    header.setFont("Helvetica", 10, leading=15)
+    for line in (
+        f"School: {school.name}",
+        f"Address: {school.address or 'N/A'}",
+        f"Phone: {school.phone_number or 'N/A'}",
+    ):
+        header.textLine(line)
+    c.drawText(header)
+
+    # Section headings (the overlay fills in the lines below each)
+    headings = c.beginText(50, RECEIPT_DETAILS_Y)
+    headings.setFont("Helvetica-Bold", 12, leading=80)
+    headings.textLine("--- Student Details ---")
+    headings.textLine("--- Payment Information ---")
+    c.drawText(headings)
+
+    # Amount/summary labels ("Outstanding Balance:" is coloured, so it's in the overlay)
+    labels = c.beginText(50, RECEIPT_AMOUNT_Y)
+    labels.setFillColor(colors.green)
+    labels.setFont("Helvetica-Bold", 14, leading=40)
+    labels.textLine("Amount Received:")
+    labels.setFillColor(colors.black)
+    labels.setFont("Helvetica-Bold", 12, leading=20)
+    labels.textLine("--- Account Status for Period ---")
+    labels.setFont("Helvetica", 10, leading=20)
+    labels.textLine("Expected Fee:")
+    labels.textLine("Total Paid to Date:")
+    c.drawText(labels)
+
+    # Footer/Signature
+    footer = c.beginText(50, 50)
+    footer.setFont("Helvetica-Oblique", 10)
+    footer.textLine("This is an electronically generated receipt and requires no signature.")
+    c.drawText(footer)
+
+def draw_receipt_details(c, payment, expected_amount_kobo, total_paid_kobo, outstanding_kobo):
+    """Draws the per-payment values on top of the school's receipt template."""
+    student = payment.student
+    height = A4[1]
+
+    # All amounts are in KOBO, so divide by 100.0 to get Naira for display
+    current_amount_naira = payment.amount_paid / 100.0
+    expected_amount = (expected_amount_kobo or 0) / 100.0
+    total_paid = total_paid_kobo / 100.0
+    outstanding_balance = outstanding_kobo / 100.0
+
+    # Receipt Details
+    receipt_info = c.beginText(400, height - 70)
+    receipt_info.setFont("Helvetica", 12, leading=15)
+    receipt_info.textLine(f"Receipt No: {payment.id}")
+    receipt_info.textLine(f"Date: {payment.payment_date.strftime('%Y-%m-%d')}")
+    c.drawText(receipt_info)
+
+    # Student Details and Payment Details, 20pt under each template heading
+    details = c.beginText(50, RECEIPT_DETAILS_Y - 20)
+    details.setFont("Helvetica", 10, leading=15)
+    for line in (
+        f"Name: {student.name}",
+        f"Reg. No: {student.reg_number}",
+        f"Class: {student.student_class}",
+    ):
+        details.textLine(line)
+    details.moveCursor(0, 35)
+    for line in (
+        f"Term: {payment.term}",
+        f"Session: {payment.session}",
+        f"Payment Type: {payment.payment_type}",
+    ):
+        details.textLine(line)
+    c.drawText(details)
+
+    # Amount column
+    values = c.beginText(200, RECEIPT_AMOUNT_Y)
+    values.setFillColor(colors.green)
+    values.setFont("Helvetica-Bold", 14, leading=60)
+    values.textLine(f"₦{current_amount_naira:,.2f}")
+    values.setFillColor(colors.black)
+    values.setFont("Helvetica", 10, leading=20)
+    values.textLine(f"₦{expected_amount:,.2f}")
+    values.textLine(f"₦{total_paid:,.2f}")
+    values.setFont("Helvetica-Bold", 12)
+    values.setFillColor(colors.red if outstanding_balance > 0 else colors.black)
+    values.textLine(f"₦{outstanding_balance:,.2f}")
+    c.drawText(values)
+
+    # Outstanding label shares the balance's colour
+    outstanding = c.beginText(50, RECEIPT_AMOUNT_Y - 100)
+    outstanding.setFont("Helvetica-Bold", 12)
+    outstanding.setFillColor(colors.red if outstanding_balance > 0 else colors.black)
+    outstanding.textLine("Outstanding Balance:")
+    c.drawText(outstanding)
+
+def receipt_template_path(school):
+    """
+    Path of the school's pre-rendered receipt template, built on first use.
+    The file name hashes the school details and logo filename, so editing the
+    school or uploading a new logo produces a fresh template.
+    """
+    version = hashlib.sha1(
+        repr((school.name, school.address, school.phone_number, school.logo_filename)).encode()
+    ).hexdigest()
+    path = os.path.join(current_app.config["RECEIPT_CACHE_DIR"], str(school.id), f"template-{version}.pdf")
+
+    if not os.path.exists(path):
+        buffer = BytesIO()
+        c = canvas.Canvas(buffer, pagesize=A4)
+        draw_receipt_template(c, school)
+        c.showPage()
+        c.save()
+        buffer.seek(0)
+        if not store_cached_receipt(path, buffer):
+            return None
+    return path
+
+def render_receipt_pdf(school, payment, expected_amount_kobo, total_paid_kobo, outstanding_kobo):
+    """
+    Builds the PDF receipt for a payment (with payment.student loaded) and
+    returns it as a file object positioned at the start. Small receipts stay in
+    memory; anything over RECEIPT_SPOOL_MAX_SIZE spills to a temp file.
+    Used by the download route and the background worker.
+
+    Only the per-payment values are drawn here; they're merged onto the school's
+    cached template page (logo, headings, labels), so the logo is never re-encoded.
+    If there is no usable template, the whole receipt is drawn in one pass instead.
+    """
+    figures = (expected_amount_kobo, total_paid_kobo, outstanding_kobo)
+    template_path = receipt_template_path(school)
+
+    if template_path is not None:
+        try:
+            overlay_buffer = BytesIO()
+            c = canvas.Canvas(overlay_buffer, pagesize=A4)
+            draw_receipt_details(c, payment, *figures)
+            c.showPage()
+            c.save()
+            overlay_buffer.seek(0)
+
+            page = PdfReader(template_path).pages[0]
+            page.merge_page(PdfReader(overlay_buffer).pages[0])
+            buffer = SpooledTemporaryFile(max_size=RECEIPT_SPOOL_MAX_SIZE)
+            writer = PdfWriter()
+            writer.add_page(page)
+            writer.write(buffer)
+            buffer.seek(0)
+            return buffer
+        except (PyPdfError, OSError) as e:
+            app.logger.warning(f"Receipt template {template_path} unusable, rendering in one pass: {e}")
+            # Drop the broken template so the next receipt rebuilds it
+            try:
+                os.remove(template_path)
+            except OSError:
+                pass
+
+    # Cache dir not writable or template unreadable: draw the whole receipt in one pass
+    buffer = SpooledTemporaryFile(max_size=RECEIPT_SPOOL_MAX_SIZE)
+    c = canvas.Canvas(buffer, pagesize=A4)
+    draw_receipt_template(c, school)
+    draw_receipt_details(c, payment, *figures)
+    c.showPage()
+    c.save()
+    buffer.seek(0)
+    return buffer
+
+def render_bulk_receipts_pdf(school, receipts):
+    """
+    Builds one multi-page PDF with a page per receipt (load_period_receipts()
+    tuples), returned like render_receipt_pdf. The school template is drawn once
+    as a ReportLab form and stamped on every page, so the logo and static text
+    are embedded a single time however many receipts there are.
+    """
+    buffer = SpooledTemporaryFile(max_size=RECEIPT_SPOOL_MAX_SIZE)
+    c = canvas.Canvas(buffer, pagesize=A4)
+    c.beginForm("receipt_template")
+    draw_receipt_template(c, school)
+    c.endForm()
+
+    for payment, *figures in receipts:
+        c.doForm("receipt_template")
+        draw_receipt_details(c, payment, *figures)
+        c.showPage()
+
+    c.save()
+    buffer.seek(0)
+    return buffer
+
+def stream_pdf_response(pdf_file, download_name, etag=None):
+    """Streams a PDF file object to the client in chunks, as an attachment."""
+    def generate():
+        with pdf_file:
+            while chunk := pdf_file.read(8192):
+                yield chunk
+
+    response = Response(
+        generate(),
+        mimetype="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{download_name}"'}
+    )
+    if etag:
+        set_receipt_cache_headers(response, etag)
+    return response
+
+def receipt_etag(school, payment, expected_amount_kobo, total_paid_kobo, outstanding_kobo):
+    """
+    ETag over every value printed on the receipt (including the period totals,
+    which change when later payments are added), so it changes whenever the PDF would.
+    """
+    student = payment.student
+    parts = (
+        payment.id, payment.amount_paid, payment.payment_date.isoformat(),
+        payment.payment_type, payment.term, payment.session,
+        student.name, student.reg_number, student.student_class,
+        school.name, school.address, school.phone_number, school.logo_filename,
+        expected_amount_kobo, total_paid_kobo, outstanding_kobo,
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def set_receipt_cache_headers(response, etag):
+    """Private (per-school) caching; the browser revalidates with If-None-Match and gets a 304."""
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def receipt_cache_path(school_id, etag):
+    """
+    On-disk location of a rendered receipt. The ETag already hashes everything
+    printed on the PDF, so a changed receipt simply gets a new file; stale ones
+    are left for prune_receipt_cache().
+    """
+    return os.path.join(current_app.config["RECEIPT_CACHE_DIR"], str(school_id), f"{etag}.pdf")
+
+def store_cached_receipt(path, pdf_file):
+    """
+    Atomically writes a rendered PDF into the receipt cache (temp file + os.replace,
+    so concurrent requests never see a partial file). Returns False if the cache
+    isn't writable; the caller then streams pdf_file directly.
+    """
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as tmp:
+            shutil.copyfileobj(pdf_file, tmp)
+        os.replace(tmp.name, path)
+        return True
+    except OSError as e:
+        logging.error(f"Failed to cache receipt PDF at {path}: {e}")
+        return False
+    finally:
+        pdf_file.seek(0)
+
+def send_cached_receipt(path, download_name, etag):
+    """Serves a cached receipt PDF from disk as an attachment."""
+    response = send_file(path, mimetype="application/pdf", as_attachment=True, download_name=download_name)
+    return set_receipt_cache_headers(response, etag)
+
+def prune_receipt_cache(max_bytes):
+    """
+    Deletes the least recently used cached receipts (by access time, falling back
+    to mtime on noatime mounts) until the cache is at most max_bytes.
+    Returns the number of files removed.
+    """
+    entries = []
+    for root, _dirs, files in os.walk(current_app.config["RECEIPT_CACHE_DIR"]):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+@app.cli.command("prune-receipt-cache")
+def prune_receipt_cache_command():
+    """Evicts old receipt PDFs until the cache fits RECEIPT_CACHE_MAX_BYTES (run from cron)."""
+    removed = prune_receipt_cache(app.config["RECEIPT_CACHE_MAX_BYTES"])
+    click.echo(f"Removed {removed} cached receipt(s).")
+
+def receipt_download_name(payment):
+    """Filename offered to the browser for a payment's PDF receipt."""
+    return f"receipt_{payment.id}_{payment.student.reg_number}.pdf"
+
+
 # ---------------------------
 # RECEIPT GENERATION ROUTES
 # ---------------------------
@@ -1180,45 +2246,32 @@ def generate_receipt(payment_id):
     Generates and displays the HTML preview of the receipt.
     """
     school = current_school()
-    payment = db.session.get(Payment, payment_id)
+    receipt = load_receipt(payment_id, school.id)
 
-    if not payment or payment.student.school_id != school.id:
+    if not receipt:
         flash("Payment not found or access denied.", "danger")
         return redirect(url_for("receipt_generator_index"))
 
+    payment, expected_amount_kobo, total_paid_kobo, outstanding_kobo = receipt
     student = payment.student
     
     logging.info(f"--- Processing Receipt ID: {payment_id} ---")
     logging.info(f"Student Class (from Payment): '{student.student_class}'")
     
-    # FIX: Use .filter() with .ilike() for case-insensitive matching on class_name
-    fee_structure = FeeStructure.query.filter(
-        FeeStructure.school_id == school.id,
-        FeeStructure.class_name.ilike(student.student_class)
-    ).first()
-    
     # Check if fee structure was found
-    if not fee_structure:
+    if expected_amount_kobo is None:
         logging.warning(f"Fee structure NOT FOUND using case-insensitive search for Class: '{student.student_class}'")
         expected_amount_naira = 0.0
     else:
-        # FIX: The expected_amount must be divided by 100.0 because it appears to be stored in KOBO (e.g., 2000000)
-        expected_amount_naira = float(fee_structure.expected_amount) / 100.0
-        logging.info(f"Fee structure FOUND. Expected Amount (Naira): {expected_amount_naira:,.2f} from class: '{fee_structure.class_name}'")
-
+        # The expected_amount is stored in KOBO, so divide by 100.0 to get Naira
+        expected_amount_naira = expected_amount_kobo / 100.0
+        logging.info(f"Fee structure FOUND. Expected Amount (Naira): {expected_amount_naira:,.2f}")
 
-    # Calculate total paid for this term/session (in database value - assumed Naira)
-    total_paid_db_value = db.session.query(db.func.sum(Payment.amount_paid)).filter(
-        Payment.student_id == student.id,
-        Payment.term == payment.term,
-        Payment.session == payment.session
-    ).scalar() or 0
-    
-    # Total paid (current and aggregate) is assumed to be stored as Naira, so no division by 100.0
-    total_paid_naira = float(total_paid_db_value) 
+    # Total paid for this term/session is stored in KOBO, so divide by 100.0 to get Naira
+    total_paid_naira = total_paid_kobo / 100.0
 
-    # Calculate outstanding balance (uses the corrected expected_amount_naira)
-    outstanding_balance_naira = max(0.0, expected_amount_naira - total_paid_naira)
+    # Outstanding balance is computed in SQL (KOBO, never negative)
+    outstanding_balance_naira = outstanding_kobo / 100.0
     
     logging.info(f"Total Paid (Naira): {total_paid_naira:,.2f}")
     logging.info(f"Outstanding Balance: {outstanding_balance_naira:,.2f}")
@@ -1226,7 +2279,7 @@ def generate_receipt(payment_id):
 
     # Render the receipt preview
     return render_template(
-        "receipt_view.html",
+        "payment_receipt_view.html",
         school=school,
         payment=payment,
         student=student,
@@ -1241,158 +2294,123 @@ def generate_receipt(payment_id):
 @login_required
 @trial_required
 def download_receipt(payment_id):
-    """Generates and downloads a PDF receipt."""
+    """
+    Downloads a PDF receipt. With a task queue configured, the PDF is built by the
+    background worker: this route enqueues the job and renders a page that polls
+    `receipt_status`, then comes back here with `?job=<id>` to fetch the result.
+    """
     school = current_school()
-    payment = db.session.get(Payment, payment_id)
+    receipt = load_receipt(payment_id, school.id)
 
-    if not payment or payment.student.school_id != school.id:
+    if not receipt:
         flash("Payment not found or access denied.", "danger")
         return redirect(url_for("receipt_generator_index"))
 
-    student = payment.student
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
+    payment = receipt[0]
 
-    # FIX: Use .filter() with .ilike() for case-insensitive matching on class_name
-    fee_structure = FeeStructure.query.filter(
-        FeeStructure.school_id == school.id,
-        FeeStructure.class_name.ilike(student.student_class)
-    ).first()
+    # Skip the PDF build entirely when the browser already has this exact receipt
+    etag = receipt_etag(school, *receipt)
+    if request.if_none_match.contains(etag):
+        return set_receipt_cache_headers(Response(status=304), etag)
 
-    # Check if fee structure was found
-    if not fee_structure:
-        expected_amount = 0.0
+    # Identical receipt already rendered: serve it from disk without touching ReportLab
+    download_name = receipt_download_name(payment)
+    cache_path = receipt_cache_path(school.id, etag)
+    if os.path.exists(cache_path):
+        return send_cached_receipt(cache_path, download_name, etag)
+
+    if task_queue is None:
+        buffer = render_receipt_pdf(school, *receipt)
     else:
-        # FIX: The expected_amount must be divided by 100.0 because it appears to be stored in KOBO (e.g., 2000000)
-        expected_amount = float(fee_structure.expected_amount) / 100.0
-
-    # Calculate total paid for this term/session (in database value - assumed Naira)
-    total_paid_db_value = db.session.query(db.func.sum(Payment.amount_paid)).filter(
-        Payment.student_id == student.id,
-        Payment.term == payment.term,
-        Payment.session == payment.session
-    ).scalar() or 0
-
-    # Total paid amount is assumed to be stored as Naira, so no division by 100.0
-    total_paid = float(total_paid_db_value)
-    
-    outstanding_balance = max(0.0, expected_amount - total_paid)
+        job_id = request.args.get("job")
+        if not job_id:
+            job = task_queue.enqueue("tasks.build_receipt", payment.id, school.id, result_ttl=300)
+            return render_template(
+                "receipt_processing.html",
+                status_url=url_for("receipt_status", job_id=job.id)
+            )
 
-    # 4. Draw PDF elements
-    # Define layout constants
-    LOGO_MARGIN_X = 50
-    TEXT_START_X = 150 
-    LOGO_WIDTH = 80
-    LOGO_HEIGHT = 80
-    TOP_Y_POS = height - 20 
+        job = fetch_job(job_id)
+        if job is None or job.args[0] != payment.id or not job.is_finished:
+            flash("Receipt is no longer available. Please try again.", "danger")
+            return redirect(url_for("receipt_generator_index"))
+        buffer = BytesIO(job.result)
 
-    # --- School Logo ---
-    logo_path = None
-    if school.logo_filename:
-        try:
-            logo_path = os.path.join(current_app.root_path, current_app.config["UPLOAD_FOLDER"], secure_filename(school.logo_filename))
-        except NameError:
-             logo_path = school.logo_filename 
-        
-        if logo_path and not os.path.exists(logo_path):
-            logo_path = None
+    if store_cached_receipt(cache_path, buffer):
+        buffer.close()
+        return send_cached_receipt(cache_path, download_name, etag)
+    return stream_pdf_response(buffer, download_name, etag=etag)
 
-    if logo_path:
-        try:
-            c.drawImage(
-                logo_path, 
-                LOGO_MARGIN_X, 
-                TOP_Y_POS - LOGO_HEIGHT, 
-                width=LOGO_WIDTH, 
-                height=LOGO_HEIGHT, 
-                preserveAspectRatio=True, 
-                anchor='n'
-            )
-        except Exception as e:
-            logging.error(f"Failed to draw logo onto PDF: {e}")
-            
-    # Title and School Info
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(TEXT_START_X, height - 50, "Official School Fee Receipt")
-    
-    c.setFont("Helvetica", 10)
-    c.drawString(TEXT_START_X, height - 70, f"School: {school.name}")
-    c.drawString(TEXT_START_X, height - 85, f"Address: {school.address or 'N/A'}")
-    c.drawString(TEXT_START_X, height - 100, f"Phone: {school.phone_number or 'N/A'}")
-    
-    # Receipt Details
-    c.setFont("Helvetica", 12)
-    c.drawString(400, height - 70, f"Receipt No: {payment.id}")
-    c.drawString(400, height - 85, f"Date: {payment.payment_date.strftime('%Y-%m-%d')}")
-    
-    # Student Details
-    y_pos = height - 150
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(50, y_pos, "--- Student Details ---")
-    c.setFont("Helvetica", 10)
-    c.drawString(50, y_pos - 20, f"Name: {student.name}")
-    c.drawString(50, y_pos - 35, f"Reg. No: {student.reg_number}")
-    c.drawString(50, y_pos - 50, f"Class: {student.student_class}")
-
-    # Payment Details
-    y_pos -= 80
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(50, y_pos, "--- Payment Information ---")
-    c.setFont("Helvetica", 10)
-    c.drawString(50, y_pos - 20, f"Term: {payment.term}")
-    c.drawString(50, y_pos - 35, f"Session: {payment.session}")
-    c.drawString(50, y_pos - 50, f"Payment Type: {payment.payment_type}")
-    
-    # Amount Details (Current Payment)
-    current_amount_naira = float(payment.amount_paid) 
-    current_amount_str = f"₦{current_amount_naira:,.2f}"
-    
-    c.setFillColor(colors.green)
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y_pos - 80, "Amount Received:")
-    c.drawString(200, y_pos - 80, current_amount_str)
-    c.setFillColor(colors.black)
-
-    # Financial Summary
-    summary_y_pos = y_pos - 120 
-    
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(50, summary_y_pos, "--- Account Status for Period ---")
-    
-    c.setFont("Helvetica", 10)
-    c.drawString(50, summary_y_pos - 20, "Expected Fee:")
-    c.drawString(200, summary_y_pos - 20, f"₦{expected_amount:,.2f}") 
-    
-    c.drawString(50, summary_y_pos - 40, "Total Paid to Date:")
-    c.drawString(200, summary_y_pos - 40, f"₦{total_paid:,.2f}") 
-    
-    c.setFont("Helvetica-Bold", 12)
-    if outstanding_balance > 0:
-        c.setFillColor(colors.red)
+
+@app.route("/receipts/bulk", endpoint="bulk_receipts")
+@login_required
+@trial_required
+def bulk_receipts():
+    """
+    Downloads every receipt of a term/session (?term=&session=) as ONE multi-page
+    PDF: a single query and a single canvas instead of a download per payment.
+    Runs on the background worker when configured, same flow as download_receipt.
+    """
+    school = current_school()
+    term = request.args.get("term", "").strip()
+    session_year = request.args.get("session", "").strip()
+    if not term or not session_year:
+        flash("Please select a term and session.", "danger")
+        return redirect(url_for("receipt_generator_index"))
+
+    if task_queue is None:
+        receipts = load_period_receipts(school.id, term, session_year)
+        buffer = render_bulk_receipts_pdf(school, receipts) if receipts else None
     else:
-        c.setFillColor(colors.black)
+        job_id = request.args.get("job")
+        if not job_id:
+            job = task_queue.enqueue(
+                "tasks.build_bulk_receipts", school.id, term, session_year,
+                result_ttl=300, job_timeout=600
+            )
+            return render_template(
+                "receipt_processing.html",
+                status_url=url_for("receipt_status", job_id=job.id)
+            )
 
-    c.drawString(50, summary_y_pos - 60, "Outstanding Balance:")
-    c.drawString(200, summary_y_pos - 60, f"₦{outstanding_balance:,.2f}")
-    c.setFillColor(colors.black)
+        job = fetch_job(job_id)
+        if job is None or tuple(job.args) != (school.id, term, session_year) or not job.is_finished:
+            flash("Receipts are no longer available. Please try again.", "danger")
+            return redirect(url_for("receipt_generator_index"))
+        buffer = BytesIO(job.result) if job.result else None
 
-    # Footer/Signature
-    c.setFont("Helvetica-Oblique", 10)
-    c.drawString(50, 50, "This is an electronically generated receipt and requires no signature.")
-    
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    
-    filename = f"receipt_{payment.id}_{student.reg_number}.pdf"
-    
-    return send_file(
-        buffer,
-        as_attachment=True,
-        download_name=filename,
-        mimetype='application/pdf'
-    )
+    if buffer is None:
+        flash(f"No payments found for {term} {session_year}.", "warning")
+        return redirect(url_for("receipt_generator_index"))
+
+    download_name = f"receipts_{secure_filename(term)}_{secure_filename(session_year)}.pdf"
+    return stream_pdf_response(buffer, download_name)
+
+
+# Position of the school_id argument in each receipt job's args
+RECEIPT_JOB_SCHOOL_ARG = {"tasks.build_receipt": 1, "tasks.build_bulk_receipts": 0}
+
+@app.route("/receipt/status/<job_id>", endpoint="receipt_status")
+@login_required
+@trial_required
+def receipt_status(job_id):
+    """JSON status of a background receipt job, polled by receipt_processing.html."""
+    school = current_school()
+    job = fetch_job(job_id) if task_queue is not None else None
+    # Receipt jobs take (payment_id, school_id), bulk jobs (school_id, term, session):
+    # only the owning school may poll them
+    school_arg = RECEIPT_JOB_SCHOOL_ARG.get(job.func_name) if job is not None else None
+    if school_arg is None or job.args[school_arg] != school.id:
+        return jsonify(error="Receipt job not found."), 404
+
+    status = job.get_status()
+    data = {"status": status}
+    if job.is_finished:
+        if job.func_name == "tasks.build_receipt":
+            data["download_url"] = url_for("download_receipt", payment_id=job.args[0], job=job.id)
+        else:
+            data["download_url"] = url_for("bulk_receipts", term=job.args[1], session=job.args[2], job=job.id)
+    return jsonify(data)
 
 
 # ---------------------------
@@ -1401,6 +2419,7 @@ def download_receipt(payment_id):
 @app.route("/fee-structure", methods=["GET", "POST"])
 @login_required
 @trial_required
+@cache.cached(timeout=300, key_prefix=school_cache_key("fees"), unless=skip_response_cache)
 def fee_structure():
     school = current_school()
 
@@ -1462,6 +2481,7 @@ def fee_structure():
             app.logger.error(f"[FEE STRUCTURE FAILED] Database commit error by user {current_user.id}: {e}")
             flash("A database error occurred while saving the fee structure.", "danger")
 
+        invalidate_school_cache(school.id, "fees", "dash")
         return redirect(url_for("fee_structure"))
 
     # 📊 Display all fee structures for this school (GET request)
@@ -1496,6 +2516,7 @@ def delete_fee_structure(id):
             # 2. Delete the record and commit
             db.session.delete(fee_to_delete)
             db.session.commit()
+            invalidate_school_cache(school.id, "fees", "dash")
             
             # 3. Success feedback and audit log
             flash(f"Fee structure for class '{class_name}' deleted successfully.", "success")
@@ -0,0 +1,17 @@
+# gunicorn.conf.py
+# Loaded automatically by `gunicorn app:app` (see Procfile: `web`).
+import multiprocessing
+import os
+
+# gevent workers: a request waiting on Paystack, Postgres or Redis yields to the
+# other requests on the worker instead of blocking the whole process. Gunicorn
+# monkey-patches the worker before importing app.py, and psycopg 3 waits on the
+# patched sockets, so no extra patching is needed.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+# Each worker holds up to DB_POOL_SIZE + DB_MAX_OVERFLOW Postgres connections:
+# keep workers * that below the database's max_connections.
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+
+timeout = 30
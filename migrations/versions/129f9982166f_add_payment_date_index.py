@@ -0,0 +1,25 @@
+"""Add payment date index
+
+Revision ID: 129f9982166f
+Revises: f1a2368f68dd
+Create Date: 2026-10-16 10:21:44.203518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '129f9982166f'
+down_revision = 'f1a2368f68dd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Newest-first payment listings (dashboard recent payments, /payments)
+    op.create_index("ix_payment_date", "payment", [sa.text("payment_date DESC")])
+
+
+def downgrade():
+    op.drop_index("ix_payment_date", table_name="payment")
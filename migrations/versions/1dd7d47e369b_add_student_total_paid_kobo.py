@@ -0,0 +1,89 @@
+"""Add student total_paid_kobo
+
+Revision ID: 1dd7d47e369b
+Revises: d5849f0d349d
+Create Date: 2026-10-16 10:05:52.410863
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1dd7d47e369b'
+down_revision = 'd5849f0d349d'
+branch_labels = None
+depends_on = None
+
+
+# Same trigger DDL as the after_create events on Payment in app.py
+POSTGRES_TRIGGER_DDL = (
+    """
+    CREATE OR REPLACE FUNCTION payment_update_student_total() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE student SET total_paid_kobo = total_paid_kobo - OLD.amount_paid WHERE id = OLD.student_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            UPDATE student SET total_paid_kobo = total_paid_kobo + NEW.amount_paid WHERE id = NEW.student_id;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER payment_student_total_trg
+    AFTER INSERT OR UPDATE OF amount_paid, student_id OR DELETE ON payment
+    FOR EACH ROW EXECUTE FUNCTION payment_update_student_total()
+    """,
+)
+
+SQLITE_TRIGGER_DDL = (
+    """
+    CREATE TRIGGER payment_student_total_ins AFTER INSERT ON payment BEGIN
+        UPDATE student SET total_paid_kobo = total_paid_kobo + NEW.amount_paid WHERE id = NEW.student_id;
+    END
+    """,
+    """
+    CREATE TRIGGER payment_student_total_upd AFTER UPDATE OF amount_paid, student_id ON payment BEGIN
+        UPDATE student SET total_paid_kobo = total_paid_kobo - OLD.amount_paid WHERE id = OLD.student_id;
+        UPDATE student SET total_paid_kobo = total_paid_kobo + NEW.amount_paid WHERE id = NEW.student_id;
+    END
+    """,
+    """
+    CREATE TRIGGER payment_student_total_del AFTER DELETE ON payment BEGIN
+        UPDATE student SET total_paid_kobo = total_paid_kobo - OLD.amount_paid WHERE id = OLD.student_id;
+    END
+    """,
+)
+
+
+def upgrade():
+    op.add_column(
+        "student",
+        sa.Column("total_paid_kobo", sa.BigInteger(), server_default="0", nullable=False)
+    )
+
+    is_postgres = op.get_bind().dialect.name == "postgresql"
+    for ddl in POSTGRES_TRIGGER_DDL if is_postgres else SQLITE_TRIGGER_DDL:
+        op.execute(ddl)
+
+    # Backfill after the triggers exist, in the same transaction, so no payment
+    # written meanwhile is missed. amount_paid is already kobo (c322eb99ca80).
+    op.execute(
+        "UPDATE student SET total_paid_kobo = ("
+        "SELECT COALESCE(SUM(payment.amount_paid), 0) FROM payment "
+        "WHERE payment.student_id = student.id)"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP TRIGGER IF EXISTS payment_student_total_trg ON payment")
+        op.execute("DROP FUNCTION IF EXISTS payment_update_student_total()")
+    else:
+        for name in ("payment_student_total_ins", "payment_student_total_upd", "payment_student_total_del"):
+            op.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+    with op.batch_alter_table("student", schema=None) as batch_op:
+        batch_op.drop_column("total_paid_kobo")
@@ -0,0 +1,38 @@
+"""Add student trigram search indexes
+
+Revision ID: 86a9ba89086b
+Revises: b846aeab9f69
+Create Date: 2026-10-16 09:44:18.096371
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '86a9ba89086b'
+down_revision = 'b846aeab9f69'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Trigram GIN indexes only exist on PostgreSQL; SQLite searches keep scanning
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index(
+        "ix_student_name_trgm", "student", ["name"],
+        postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}
+    )
+    op.create_index(
+        "ix_student_reg_trgm", "student", ["reg_number"],
+        postgresql_using="gin", postgresql_ops={"reg_number": "gin_trgm_ops"}
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.drop_index("ix_student_reg_trgm", table_name="student")
+    op.drop_index("ix_student_name_trgm", table_name="student")
+    # pg_trgm is left installed: other objects may depend on it
@@ -0,0 +1,47 @@
+"""Add student and payment lookup indexes
+
+Revision ID: b846aeab9f69
+Revises: c322eb99ca80
+Create Date: 2026-10-16 09:31:07.552930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b846aeab9f69'
+down_revision = 'c322eb99ca80'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The unique constraint can't be added over duplicates, and merging two students
+    # means moving their payments, so list them and stop instead of guessing.
+    duplicates = op.get_bind().execute(sa.text(
+        "SELECT school_id, reg_number, COUNT(*) FROM student "
+        "GROUP BY school_id, reg_number HAVING COUNT(*) > 1"
+    )).fetchall()
+    if duplicates:
+        listed = ", ".join(f"school {school_id}: {reg_number!r} x{count}" for school_id, reg_number, count in duplicates)
+        raise RuntimeError(
+            "Duplicate student registration numbers must be resolved (renamed or merged) "
+            f"before adding _school_reg_uc: {listed}"
+        )
+
+    with op.batch_alter_table("student", schema=None) as batch_op:
+        batch_op.create_unique_constraint("_school_reg_uc", ["school_id", "reg_number"])
+        batch_op.create_index("ix_student_school_name", ["school_id", "name"])
+
+    op.create_index("ix_payment_student_date", "payment", ["student_id", sa.text("payment_date DESC")])
+    op.create_index("ix_payment_term_session", "payment", ["term", "session"])
+
+
+def downgrade():
+    op.drop_index("ix_payment_term_session", table_name="payment")
+    op.drop_index("ix_payment_student_date", table_name="payment")
+
+    with op.batch_alter_table("student", schema=None) as batch_op:
+        batch_op.drop_index("ix_student_school_name")
+        batch_op.drop_constraint("_school_reg_uc", type_="unique")
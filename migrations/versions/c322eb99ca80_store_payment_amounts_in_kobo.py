@@ -0,0 +1,40 @@
+"""Store payment amounts in kobo
+
+Revision ID: c322eb99ca80
+Revises: 54178d053519
+Create Date: 2026-10-16 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c322eb99ca80'
+down_revision = '54178d053519'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are Naira floats: convert them to kobo before changing the type
+    op.execute("UPDATE payment SET amount_paid = ROUND(amount_paid * 100)")
+    with op.batch_alter_table("payment", schema=None) as batch_op:
+        batch_op.alter_column(
+            "amount_paid",
+            existing_type=sa.Float(),
+            type_=sa.Integer(),
+            existing_nullable=False,
+            postgresql_using="ROUND(amount_paid)::integer",
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("payment", schema=None) as batch_op:
+        batch_op.alter_column(
+            "amount_paid",
+            existing_type=sa.Integer(),
+            type_=sa.Float(),
+            existing_nullable=False,
+        )
+    op.execute("UPDATE payment SET amount_paid = amount_paid / 100.0")
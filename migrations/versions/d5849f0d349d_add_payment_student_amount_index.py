@@ -0,0 +1,27 @@
+"""Add payment student amount index
+
+Revision ID: d5849f0d349d
+Revises: 86a9ba89086b
+Create Date: 2026-10-16 09:52:36.774102
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5849f0d349d'
+down_revision = '86a9ba89086b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Covers SUM(amount_paid) per student (optionally per term/session) as an index-only scan
+    op.create_index(
+        "ix_payment_student_amount", "payment",
+        ["student_id", "term", "session", "amount_paid"]
+    )
+
+
+def downgrade():
+    op.drop_index("ix_payment_student_amount", table_name="payment")
@@ -0,0 +1,28 @@
+"""Add fee structure lower(class_name) index
+
+Revision ID: f1a2368f68dd
+Revises: 1dd7d47e369b
+Create Date: 2026-10-16 10:14:09.865127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a2368f68dd'
+down_revision = '1dd7d47e369b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serves the case-insensitive lower(class_name) = lower(student_class) fee lookups
+    op.create_index(
+        "ix_fee_structure_school_class_lower", "fee_structure",
+        ["school_id", sa.text("lower(class_name)")]
+    )
+
+
+def downgrade():
+    op.drop_index("ix_fee_structure_school_class_lower", table_name="fee_structure")
@@ -5,9 +5,10 @@ from io import BytesIO
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 import os
+from collections import defaultdict
 from datetime import datetime, timedelta
-from sqlalchemy import UniqueConstraint, func
-from sqlalchemy.orm import joinedload
+from sqlalchemy import Index, UniqueConstraint, func
+from sqlalchemy.orm import joinedload, raiseload
 from functools import wraps
 from .subscriptions import subscriptions # Import the subscription blueprint
 
@@ -90,6 +91,12 @@ class Payment(db.Model):
     session = db.Column(db.String(20))
     student_id = db.Column(db.Integer, db.ForeignKey("student.id"), nullable=False)
 
+    # Per-student term/session totals (view_receipt, student lookup) and per-student history
+    __table_args__ = (
+        Index('ix_payment_student_term_session', 'student_id', 'term', 'session'),
+        Index('ix_payment_student_date', 'student_id', 'payment_date'),
+    )
+
 class Fee(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     school_id = db.Column(db.Integer, db.ForeignKey('school.id'), nullable=False) # Multi-tenant Key
@@ -107,6 +114,7 @@ class Fee(db.Model):
 # MIDDLEWARE & AUTH (Updated for Multi-Tenancy/Subscription)
 # ---------------------------
 ADMIN_USER = "admin"
+RECENT_PAYMENTS_LIMIT = 5 # Payments shown per student on the receipt generator
 ADMIN_PASS = "password" # 🔴 Change this in production!
 
 def check_admin(f):
@@ -190,13 +198,15 @@ def dashboard():
     total_students = Student.query.filter_by(school_id=school_id).count()
     
     # Total payments: join on student table to ensure payments belong to this school's students
-    total_payments = db.session.query(db.func.sum(Payment.amount_paid)).join(Student).filter(
+    total_payments = db.session.query(db.func.coalesce(db.func.sum(Payment.amount_paid), 0)).join(Student).filter(
         Student.school_id == school_id
-    ).scalar() or 0
+    ).scalar()
     
     outstanding_balance = 0 # Complex calculation, left as 0 for now
     
-    recent_payments = Payment.query.join(Student).filter(
+    # Student eager-loaded in the same query (the template renders p.student.name);
+    # raiseload("*") turns any other lazy load into an error instead of an extra SELECT
+    recent_payments = Payment.query.options(joinedload(Payment.student), raiseload("*")).join(Student).filter(
         Student.school_id == school_id
     ).order_by(Payment.payment_date.desc()).limit(5).all()
 
@@ -387,19 +397,21 @@ def student_financials():
     if not all([student_id, term, session_year]):
         return jsonify({"error": "Missing parameters"}), 400
 
-    # Multi-tenant check
-    student = Student.query.filter_by(id=student_id, school_id=school_id).first()
-    if not student:
-        return jsonify({"error": "Student not found or permission denied"}), 404
-
-    # Multi-tenant fee lookup
-    fee_record = Fee.query.filter_by(
-        school_id=school_id,
-        student_class=student.student_class,
-        term=term,
-        session=session_year
+    # Multi-tenant check and fee lookup in one round trip: the class's fee for the
+    # term/session comes back as a correlated scalar subquery next to the student
+    fee_amount = db.select(Fee.amount).where(
+        Fee.school_id == Student.school_id,
+        Fee.student_class == Student.student_class,
+        Fee.term == term,
+        Fee.session == session_year
+    ).limit(1).scalar_subquery()
+    row = db.session.execute(
+        db.select(Student, fee_amount).where(Student.id == student_id, Student.school_id == school_id)
     ).first()
-    total_fee = fee_record.amount if fee_record else 0
+    if not row:
+        return jsonify({"error": "Student not found or permission denied"}), 404
+    student, total_fee = row
+    total_fee = total_fee or 0
 
     payments = Payment.query.filter_by(
         student_id=student.id,
@@ -500,7 +512,32 @@ def receipt_generator():
                 Student.school_id == school_id, # Multi-tenant filter
                 (Student.name.ilike(f"%{query}%")) |
                 (Student.reg_number.ilike(f"%{query}%"))
-            ).options(joinedload(Student.payments)).all()
+            ).options(raiseload("*")).all()
+
+    # Attach recent payments to each student: one IN (...) query for the whole
+    # batch, fanned out in Python, instead of one payments query per student.
+    # row_number() keeps the per-student LIMIT in SQL, so older payments are never fetched.
+    if search_results:
+        student_ids = [s.id for s in search_results]
+        ranked = db.select(
+            Payment.id,
+            func.row_number().over(
+                partition_by=Payment.student_id,
+                order_by=Payment.payment_date.desc()
+            ).label("rn")
+        ).where(Payment.student_id.in_(student_ids)).subquery()
+
+        payments = Payment.query.join(
+            ranked, Payment.id == ranked.c.id
+        ).filter(
+            ranked.c.rn <= RECENT_PAYMENTS_LIMIT
+        ).order_by(Payment.student_id, Payment.payment_date.desc()).all()
+
+        payments_by_student = defaultdict(list)
+        for p in payments:
+            payments_by_student[p.student_id].append(p)
+        for s in search_results:
+            s.recent_payments = payments_by_student[s.id]
     
     return render_template("receipt_generator.html", search_results=search_results)
 
@@ -532,11 +569,11 @@ def view_receipt(payment_id):
     total_fees = fee_record.amount if fee_record else 0
 
     # Get the total amount paid by the student for the specific term/session
-    total_paid_for_term = db.session.query(db.func.sum(Payment.amount_paid)).filter(
+    total_paid_for_term = db.session.query(db.func.coalesce(db.func.sum(Payment.amount_paid), 0)).filter(
         Payment.student_id == student.id,
         Payment.term == payment.term,
         Payment.session == payment.session
-    ).scalar() or 0
+    ).scalar()
     
     remaining_balance = total_fees - total_paid_for_term
 
@@ -0,0 +1,49 @@
+# tasks.py
+# Background jobs executed by the RQ worker (see Procfile: `worker`).
+# Jobs are enqueued by dotted name from app.py, e.g. task_queue.enqueue("tasks.build_receipt", payment.id)
+import logging
+
+import requests
+
+from app import (
+    app, db, School, load_period_receipts, load_receipt,
+    render_bulk_receipts_pdf, render_receipt_pdf, verify_subscription_payment
+)
+
+
+def build_receipt(payment_id, school_id):
+    """Renders the PDF receipt for a payment and returns the PDF bytes (stored as the job result)."""
+    with app.app_context():
+        school = db.session.get(School, school_id)
+        receipt = load_receipt(payment_id, school_id) if school else None
+        if receipt is None:
+            return None
+        with render_receipt_pdf(school, *receipt) as pdf_file:
+            return pdf_file.read()
+
+
+def build_bulk_receipts(school_id, term, session):
+    """Renders every receipt of a term/session into one PDF and returns its bytes (None if there are none)."""
+    with app.app_context():
+        school = db.session.get(School, school_id)
+        receipts = load_period_receipts(school_id, term, session) if school else None
+        if not receipts:
+            return None
+        with render_bulk_receipts_pdf(school, receipts) as pdf_file:
+            return pdf_file.read()
+
+
+def verify_paystack(reference, school_id):
+    """Verifies a Paystack subscription payment and extends the school's subscription."""
+    with app.app_context():
+        school = db.session.get(School, school_id)
+        if school is None:
+            return False
+        try:
+            verified = verify_subscription_payment(school, reference)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Paystack API error during background verification: {e}")
+            raise
+        if not verified:
+            logging.warning(f"Paystack payment {reference} for school {school_id} was not verified.")
+        return verified